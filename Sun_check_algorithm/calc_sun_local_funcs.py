@@ -1,18 +1,100 @@
 import math
-import pandas as pd
-from statistics import median, mean
-from collections import Counter 
-import folium
-from folium.plugins import HeatMap
-import webbrowser
-from scipy.spatial import ConvexHull
-from datetime import date
-from haversine import haversine, Unit
+import json
+import heapq
+import datetime
+import numpy as np
+from datetime import date, timezone
 import sys
+import solar_kernels
+
+
+def _as_datetime64(datetimes):
+    """
+    Convert a timestamp or an array-like of timestamps to a numpy datetime64[s] array.
+
+    Timezone aware values keep their wall clock time, matching how calculate_solar_position
+    reads the hour and minute straight off the timestamp.
+
+    Args:
+        datetimes (datetime, pd.Timestamp, str, or array-like): The timestamp(s) to convert.
+
+    Returns:
+        numpy.ndarray: The timestamps as a datetime64[s] array with the input's shape.
+    """
+    values = np.asarray(datetimes)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[s]")
+
+    naive = [value.replace(tzinfo=None) if getattr(value, "tzinfo", None) is not None else value
+             for value in values.ravel()]
+    return np.array(naive, dtype="datetime64[s]").reshape(values.shape)
+
+
+def _fibonacci_cap(center_latitude, center_longitude, radius, count):
+    """
+    Spread points nearly uniformly (equal area per point) over a spherical cap.
+
+    The points follow a Fibonacci spiral around the center, so a radius of 180 degrees covers
+    the whole globe. Positions are built as unit vectors, which keeps the poles and the
+    dateline free of special cases.
+
+    Args:
+        center_latitude (float): The latitude of the cap center in degrees.
+        center_longitude (float): The longitude of the cap center in degrees.
+        radius (float): The angular radius of the cap in degrees.
+        count (int): The number of points.
+
+    Returns:
+        tuple: Arrays of the latitudes and longitudes (-180 to 180) of the points in degrees.
+    """
+    index = np.arange(count) + 0.5
+    # Equal area rings, 1 - cos(distance) = (1 - cos(radius)) * index / count, written without the cancellation
+    # of 1 - cos so caps down to 1e-9 degrees keep distinct points
+    distance = 2 * np.arcsin(np.sin(np.radians(radius) / 2) * np.sqrt(index / count))
+    bearing = index * np.pi * (3 - np.sqrt(5))
+
+    latitude = np.radians(center_latitude)
+    longitude = np.radians(center_longitude)
+    center = np.array([np.cos(latitude) * np.cos(longitude), np.cos(latitude) * np.sin(longitude), np.sin(latitude)])
+    north = np.array([-np.sin(latitude) * np.cos(longitude), -np.sin(latitude) * np.sin(longitude), np.cos(latitude)])
+    east = np.array([-np.sin(longitude), np.cos(longitude), 0.0])
+
+    points = (np.cos(distance)[:, None] * center +
+              np.sin(distance)[:, None] * (np.cos(bearing)[:, None] * north + np.sin(bearing)[:, None] * east))
+    return (np.degrees(np.arcsin(np.clip(points[:, 2], -1.0, 1.0))),
+            np.degrees(np.arctan2(points[:, 1], points[:, 0])))
+
+
+class SolarEpoch:
+    """
+    The parts of the solar position that only depend on the timestamp.
+
+    Everything here is shared by every latitude and longitude evaluated for the same
+    timestamp, so a search only has to calculate it once.
+
+    Attributes:
+        day_of_year (int): The day of the year (1-365/366).
+        minute_of_day (int): The minutes elapsed since midnight UTC.
+        declination_angle (float): The solar declination angle in radians.
+        sin_declination (float): The sine of the declination angle.
+        cos_declination (float): The cosine of the declination angle.
+        EoT (float): The equation of time in minutes.
+    """
+    def __init__(self, day_of_year, minute_of_day, declination_angle, EoT):
+        self.day_of_year = day_of_year
+        self.minute_of_day = minute_of_day
+        self.declination_angle = declination_angle
+        self.sin_declination = math.sin(declination_angle)
+        self.cos_declination = math.cos(declination_angle)
+        self.EoT = EoT
+
 
 class functions:
+    # Number of timestamps kept in the solar epoch cache before it is emptied
+    epoch_cache_size = 4096
+
     def __init__(self):
-        pass
+        self.epoch_cache = {}
 
     def calc_declenation_angle(self, dElapsedJulianDays, day_of_year):
         """
@@ -73,39 +155,65 @@ class functions:
         return max(0, solar_elevation)  # Ensure solar elevation is non-negative
     
     
-    def calculate_solar_position(self, datetime, latitude, longitude):
+    def solar_epoch(self, datetime):
         """
-        Calculate the solar azimuth and altitude angles for a given datetime, latitude, and longitude.
+        Return the timestamp-only terms of the solar position, memoized by timestamp.
+
+        Only the date, hour and minute affect the solar position, so timestamps that differ in
+        their seconds share a cache entry.
 
         Args:
             datetime (datetime): The date and time for which to calculate solar position.
-            latitude (float): The latitude of the location in degrees (-90 to 90).
-            longitude (float): The longitude of the location in degrees (-180 to 180).
 
         Returns:
-            tuple: A tuple containing the solar azimuth angle (in degrees) and solar altitude angle (in degrees).
+            SolarEpoch: The declination, equation of time, day of year and minute of day.
         """
+        key = (datetime.year, datetime.month, datetime.day, datetime.hour, datetime.minute)
+        epoch = self.epoch_cache.get(key)
+        if epoch is not None:
+            return epoch
+
         # Calculate the number of days since the start of the year
         day_of_year = datetime.timetuple().tm_yday
-        year = datetime.timetuple().tm_year
-        month = datetime.timetuple().tm_mon
-        day = datetime.timetuple().tm_mday
-
-        dElapsedJulianDays = (date(year, month, day) - date(2000, 1, 1)).days
+        dElapsedJulianDays = (date(datetime.year, datetime.month, datetime.day) - date(2000, 1, 1)).days
 
         # Calculate the solar declination angle
         declination_angle = self.calc_declenation_angle(dElapsedJulianDays, day_of_year)
 
-        # Calculate the solar hour angle
-        # Local Standad Time Meridian
-        LSTM = 15 * abs(0) # LSTM = 15 * UTC Difference
         # Equation of time
         B = math.radians((360/365) * (day_of_year - 81))
         EoT = 9.87*math.sin(2*B) - 7.53*math.cos(B) - 1.5*math.sin(B)
+
+        epoch = SolarEpoch(day_of_year, (60 * datetime.hour) + datetime.minute, declination_angle, EoT)
+        if len(self.epoch_cache) >= self.epoch_cache_size:
+            self.epoch_cache.clear()
+        self.epoch_cache[key] = epoch
+        return epoch
+
+
+    def calculate_solar_position(self, datetime, latitude, longitude, epoch=None):
+        """
+        Calculate the solar azimuth and altitude angles for a given datetime, latitude, and longitude.
+
+        Args:
+            datetime (datetime): The date and time for which to calculate solar position.
+            latitude (float): The latitude of the location in degrees (-90 to 90).
+            longitude (float): The longitude of the location in degrees (-180 to 180).
+            epoch (SolarEpoch, optional): Precomputed terms for datetime. Looked up with solar_epoch when omitted.
+
+        Returns:
+            tuple: A tuple containing the solar azimuth angle (in degrees) and solar altitude angle (in degrees).
+        """
+        if epoch is None:
+            epoch = self.solar_epoch(datetime)
+
+        # Calculate the solar hour angle
+        # Local Standad Time Meridian
+        LSTM = 15 * abs(0) # LSTM = 15 * UTC Difference
         # Time Correction Factor
-        TC = 4 * (longitude - LSTM) + EoT
+        TC = 4 * (longitude - LSTM) + epoch.EoT
         # Local Solar Time
-        LST = ((60 * datetime.hour) + datetime.minute + TC) / 60
+        LST = (epoch.minute_of_day + TC) / 60
         # Hour Angle
         hour_angle = math.radians(15 * (LST - 12))
         # hour_angle = math.radians(15 * (datetime.hour - 12) + (datetime.minute / 4) - longitude)
@@ -114,14 +222,14 @@ class functions:
         longitude = math.radians(longitude)
         
         
-        altitude_angle = math.asin(math.sin(latitude) * math.sin(declination_angle) +
-                                   math.cos(latitude) * math.cos(declination_angle) * math.cos(hour_angle))
+        altitude_angle = math.asin(math.sin(latitude) * epoch.sin_declination +
+                                   math.cos(latitude) * epoch.cos_declination * math.cos(hour_angle))
 
         
         # Calculate solar azimuth angle
-        azimuth_angle = math.atan2(-math.cos(declination_angle) * math.sin(hour_angle),
-                                math.cos(latitude) * math.sin(declination_angle) -
-                                math.sin(latitude) * math.cos(declination_angle) *
+        azimuth_angle = math.atan2(-epoch.cos_declination * math.sin(hour_angle),
+                                math.cos(latitude) * epoch.sin_declination -
+                                math.sin(latitude) * epoch.cos_declination *
                                 math.cos(hour_angle))
 
         # Convert angles to degrees
@@ -131,12 +239,576 @@ class functions:
         return azimuth_deg, altitude_deg
 
 
+    def calc_declenation_angle_array(self, dElapsedJulianDays):
+        """
+        Calculate the solar declination angle for an array of elapsed days.
+
+        Args:
+            dElapsedJulianDays (numpy.ndarray): The number of days elapsed since 2000-01-01.
+
+        Returns:
+            numpy.ndarray: The solar declination angles in radians.
+        """
+        dOmega = 2.1429 - 0.0010394594 * dElapsedJulianDays
+        dMeanLongitude = 4.8950630 + 0.017202791698 * dElapsedJulianDays  # Radians
+        dMeanAnomaly = (6.2400600 + 0.0172019699 * dElapsedJulianDays)
+        dEclipticLongitude = dMeanLongitude + 0.03341607 * np.sin(dMeanAnomaly) + 0.00034894 * np.sin(2 * dMeanAnomaly) - 0.0001134 - 0.0000203 * np.sin(dOmega)
+        dEclipticObliquity = 0.4090928 - 6.2140e-9 * dElapsedJulianDays + 0.0000396 * np.cos(dOmega)
+
+        return np.arcsin(np.sin(dEclipticObliquity) * np.sin(dEclipticLongitude))
+
+
+    def solar_time_terms_array(self, datetimes):
+        """
+        Calculate the parts of the solar position that only depend on the timestamp.
+
+        Args:
+            datetimes (datetime or array-like): The timestamp(s) to calculate the terms for.
+
+        Returns:
+            tuple: Arrays of the declination angle (radians), the equation of time (minutes)
+                   and the minute of the day, each with the shape of datetimes.
+        """
+        values = _as_datetime64(datetimes)
+        days = values.astype("datetime64[D]")
+
+        dElapsedJulianDays = (days - np.datetime64("2000-01-01", "D")).astype(np.int64)
+        day_of_year = (days - days.astype("datetime64[Y]")).astype(np.int64) + 1
+        # Seconds are dropped, the same as the scalar path which only reads hour and minute
+        minute_of_day = ((values - days) // np.timedelta64(1, "m")).astype(np.int64)
+
+        declination_angle = self.calc_declenation_angle_array(dElapsedJulianDays)
+
+        # Equation of time
+        B = np.radians((360/365) * (day_of_year - 81))
+        EoT = 9.87*np.sin(2*B) - 7.53*np.cos(B) - 1.5*np.sin(B)
+
+        return declination_angle, EoT, minute_of_day
+
+
+    def solar_position_from_terms(self, declination_angle, EoT, minute_of_day, latitudes, longitudes):
+        """
+        Calculate solar azimuth and altitude angles from precomputed timestamp terms.
+
+        All arguments are broadcast against each other.
+
+        Args:
+            declination_angle (numpy.ndarray): The solar declination angle in radians.
+            EoT (numpy.ndarray): The equation of time in minutes.
+            minute_of_day (numpy.ndarray): The minutes elapsed since midnight UTC.
+            latitudes (numpy.ndarray): The latitudes in degrees (-90 to 90).
+            longitudes (numpy.ndarray): The longitudes in degrees (-180 to 180).
+
+        Returns:
+            tuple: Arrays of the solar azimuth angles (in degrees) and solar altitude angles (in degrees).
+        """
+        # Local Solar Time, with the time correction factor 4 * longitude + EoT
+        LST = (minute_of_day + 4 * np.asarray(longitudes, dtype=float) + EoT) / 60
+        hour_angle = np.radians(15 * (LST - 12))
+
+        latitude = np.radians(latitudes)
+        sin_latitude = np.sin(latitude)
+        cos_latitude = np.cos(latitude)
+        sin_declination = np.sin(declination_angle)
+        cos_declination = np.cos(declination_angle)
+        cos_hour_angle = np.cos(hour_angle)
+
+        altitude_angle = np.arcsin(np.clip(sin_latitude * sin_declination +
+                                           cos_latitude * cos_declination * cos_hour_angle, -1.0, 1.0))
+
+        azimuth_angle = np.arctan2(-cos_declination * np.sin(hour_angle),
+                                   cos_latitude * sin_declination -
+                                   sin_latitude * cos_declination * cos_hour_angle)
+
+        return np.degrees(azimuth_angle), np.degrees(altitude_angle)
+
+
+    def calculate_solar_position_array(self, datetimes, latitudes, longitudes):
+        """
+        Calculate solar azimuth and altitude angles for arrays of datetimes, latitudes, and longitudes.
+
+        This is the vectorized counterpart of calculate_solar_position and gives the same
+        numbers. The inputs are broadcast against each other, so a single timestamp can be
+        paired with a whole grid of coordinates.
+
+        Args:
+            datetimes (datetime or array-like): The date(s) and time(s) for which to calculate solar position.
+            latitudes (float or array-like): The latitude(s) of the locations in degrees (-90 to 90).
+            longitudes (float or array-like): The longitude(s) of the locations in degrees (-180 to 180).
+
+        Returns:
+            tuple: Arrays of the solar azimuth angles (in degrees) and solar altitude angles (in degrees).
+        """
+        declination_angle, EoT, minute_of_day = self.solar_time_terms_array(datetimes)
+        return self.solar_position_from_terms(declination_angle, EoT, minute_of_day, latitudes, longitudes)
+
+
+    def solar_position_jacobian_array(self, datetimes, latitudes, longitudes, delta=1e-5):
+        """
+        Calculate how the solar azimuth and elevation change with latitude and longitude.
+
+        The derivatives are taken with central finite differences of solar_position_from_terms,
+        with the azimuth differences wrapped to +-180. All inputs are broadcast against each other.
+
+        Args:
+            datetimes (datetime or array-like): The UTC date(s) and time(s).
+            latitudes (float or array-like): The latitude(s) in degrees (-90 to 90).
+            longitudes (float or array-like): The longitude(s) in degrees (-180 to 180).
+            delta (float, optional): The finite difference step in degrees. Defaults to 1e-5.
+
+        Returns:
+            numpy.ndarray: An array of shape (..., 2, 2) holding
+                           [[d azimuth / d lat, d azimuth / d lon], [d elevation / d lat, d elevation / d lon]]
+                           in degrees per degree.
+        """
+        terms = self.solar_time_terms_array(datetimes)
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+
+        def difference(lat_step, lon_step):
+            azimuth_plus, elevation_plus = self.solar_position_from_terms(*terms, latitudes + lat_step, longitudes + lon_step)
+            azimuth_minus, elevation_minus = self.solar_position_from_terms(*terms, latitudes - lat_step, longitudes - lon_step)
+            return ((azimuth_plus - azimuth_minus + 180) % 360 - 180) / (2 * delta), (elevation_plus - elevation_minus) / (2 * delta)
+
+        d_azimuth_d_lat, d_elevation_d_lat = difference(delta, 0)
+        d_azimuth_d_lon, d_elevation_d_lon = difference(0, delta)
+        return np.stack((np.stack((d_azimuth_d_lat, d_azimuth_d_lon), axis=-1),
+                         np.stack((d_elevation_d_lat, d_elevation_d_lon), axis=-1)), axis=-2)
+
+
+    def solve_location_analytic_array(self, datetimes, solar_azimuths, solar_elevations):
+        """
+        Solve for the observer positions directly with spherical trigonometry.
+
+        The sun sits at the zenith of the subsolar point (latitude = declination), so the observer
+        lies at an angular distance of 90 - elevation from it. The observer latitude follows from
+            sin(declination) = sin(lat) cos(zenith) + cos(lat) sin(zenith) cos(azimuth)
+        which has up to two roots; the root whose forward solar position best matches the
+        measurement is kept (for a low sun both roots can match exactly, and the first one is
+        returned). The hour angle, and from it the longitude, then follows from the
+        azimuth. All inputs are broadcast against each other.
+
+        Args:
+            datetimes (datetime or array-like): The UTC date(s) and time(s) of the measurements.
+            solar_azimuths (float or array-like): The measured solar azimuths in degrees clockwise from north.
+            solar_elevations (float or array-like): The measured solar elevations in degrees.
+
+        Returns:
+            tuple: Arrays of latitudes and longitudes in degrees, NaN where no position
+                   produces the measurement.
+        """
+        declination_angle, EoT, minute_of_day = self.solar_time_terms_array(datetimes)
+        azimuth = np.radians(solar_azimuths)
+        zenith = np.radians(90 - np.asarray(solar_elevations, dtype=float))
+
+        # a * sin(lat) + b * cos(lat) = sin(declination)  ->  R * sin(lat + psi) = sin(declination)
+        a = np.cos(zenith)
+        b = np.sin(zenith) * np.cos(azimuth)
+        R = np.hypot(a, b)
+        psi = np.arctan2(b, a)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            root = np.arcsin(np.sin(declination_angle) / R)
+
+        best_latitudes = None
+        best_longitudes = None
+        best_residuals = None
+        for candidate in (root - psi, np.pi - root - psi):
+            # Wrap to (-pi, pi] before checking the candidate is a real latitude
+            latitude = np.arctan2(np.sin(candidate), np.cos(candidate))
+            latitude = np.where(np.abs(latitude) <= np.pi / 2, latitude, np.nan)
+
+            hour_angle = np.arctan2(-np.sin(azimuth) * np.sin(zenith) * np.cos(latitude),
+                                    np.cos(zenith) - np.sin(latitude) * np.sin(declination_angle))
+            # Invert hour_angle = 15 * (LST - 12) with LST = (minute_of_day + 4 * longitude + EoT) / 60
+            longitude = np.degrees(hour_angle) + 180 - (minute_of_day + EoT) / 4
+            longitude = (longitude + 180) % 360 - 180
+            latitude = np.degrees(latitude)
+
+            calculated_azimuth, calculated_elevation = self.solar_position_from_terms(
+                declination_angle, EoT, minute_of_day, latitude, longitude)
+            residual = (np.abs((calculated_azimuth - solar_azimuths + 180) % 360 - 180) +
+                        np.abs(calculated_elevation - solar_elevations))
+            residual = np.where(np.isnan(residual), np.inf, residual)
+
+            if best_residuals is None:
+                best_latitudes, best_longitudes, best_residuals = latitude, longitude, residual
+            else:
+                better = residual < best_residuals
+                best_latitudes = np.where(better, latitude, best_latitudes)
+                best_longitudes = np.where(better, longitude, best_longitudes)
+                best_residuals = np.where(better, residual, best_residuals)
+
+        # Measurements no position can produce (e.g. an elevation the sun never reaches today)
+        solved = best_residuals <= 1e-6
+        return np.where(solved, best_latitudes, np.nan), np.where(solved, best_longitudes, np.nan)
+
+
+    def solve_location_analytic(self, local_datetime, solar_azimuth, solar_elevation):
+        """
+        Solve for the observer position of a single measurement with spherical trigonometry.
+
+        Args:
+            local_datetime (datetime): The UTC date and time of the measurement.
+            solar_azimuth (float): The measured solar azimuth angle in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+
+        Returns:
+            tuple or None: The latitude and longitude of the observer, or None if no position
+                           produces the measurement.
+        """
+        latitude, longitude = self.solve_location_analytic_array(local_datetime, solar_azimuth, solar_elevation)
+        if np.isnan(latitude):
+            return None
+        return (float(latitude), float(longitude))
+
+
+    def subsolar_point(self, local_datetime):
+        """
+        Find the point on Earth where the sun is directly overhead.
+
+        Args:
+            local_datetime (datetime): The UTC date and time.
+
+        Returns:
+            tuple: The latitude (the declination) and longitude of the subsolar point in degrees.
+        """
+        epoch = self.solar_epoch(local_datetime)
+        # The hour angle 15 * (LST - 12) is zero where 4 * longitude = 720 - minute_of_day - EoT
+        longitude = 180 - (epoch.minute_of_day + epoch.EoT) / 4
+        return math.degrees(epoch.declination_angle), (longitude + 180) % 360 - 180
+
+
+    def feasible_longitude_range(self, epoch, latitude, solar_elevation, margin):
+        """
+        Find the longitudes of a latitude row that lie near the circle of equal elevation.
+
+        The angular distance d from the subsolar point satisfies
+            cos(d) = sin(lat) sin(declination) + cos(lat) cos(declination) cos(longitude difference)
+        and the measured elevation puts the observer at d = 90 - elevation. Solving for the
+        longitude difference at d = 90 - elevation +- margin bounds the feasible band.
+
+        Args:
+            epoch (SolarEpoch): The solar epoch of the measurement.
+            latitude (float): The latitude of the row in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+            margin (float): The allowed distance from the circle in degrees.
+
+        Returns:
+            tuple or None: The smallest and largest absolute longitude difference from the subsolar
+                           point in degrees, or None if no longitude of this row is feasible.
+        """
+        zenith = 90 - solar_elevation
+        cos_far = math.cos(math.radians(min(zenith + margin, 180)))
+        cos_near = math.cos(math.radians(max(zenith - margin, 0)))
+
+        sin_term = math.sin(math.radians(latitude)) * epoch.sin_declination
+        cos_term = math.cos(math.radians(latitude)) * epoch.cos_declination
+        if cos_term < 1e-12:
+            # At the poles every longitude is the same distance from the subsolar point
+            return (0, 180) if cos_far <= sin_term <= cos_near else None
+
+        lower = (cos_far - sin_term) / cos_term
+        upper = (cos_near - sin_term) / cos_term
+        if lower > 1 or upper < -1:
+            return None
+        return math.degrees(math.acos(min(upper, 1))), math.degrees(math.acos(max(lower, -1)))
+
+
+    def location_residual(self, local_datetime, solar_azimuth, solar_elevation, location):
+        """
+        Calculate how far the solar position at a location is from the measured one.
+
+        Args:
+            local_datetime (datetime): The UTC date and time of the measurement.
+            solar_azimuth (float): The measured solar azimuth angle in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+            location (tuple): The latitude and longitude to check.
+
+        Returns:
+            float: The sum of the absolute azimuth (wrapped to +-180) and elevation differences in degrees.
+        """
+        calculated_azimuth, calculated_elevation = self.calculate_solar_position(local_datetime, location[0], location[1])
+        return abs((calculated_azimuth - solar_azimuth + 180) % 360 - 180) + abs(calculated_elevation - solar_elevation)
+
+
+    def refine_location_newton(self, local_datetime, solar_azimuth, solar_elevation, initial_location,
+                               tolerance=1e-6, max_iterations=50, delta=1e-6):
+        """
+        Refine a location with Gauss-Newton steps on the azimuth/elevation residual.
+
+        The 2x2 Jacobian of (azimuth, elevation) with respect to (latitude, longitude) is taken with
+        forward finite differences, and each step is halved until the residual improves.
+
+        Args:
+            local_datetime (datetime): The UTC date and time of the measurement.
+            solar_azimuth (float): The measured solar azimuth angle in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+            initial_location (tuple): The latitude and longitude to start from, e.g. the best coarse grid cell.
+            tolerance (float, optional): Stop once the residual (see location_residual) is at or below this. Defaults to 1e-6.
+            max_iterations (int, optional): The maximum number of Newton steps. Defaults to 50.
+            delta (float, optional): The finite difference step in degrees. Defaults to 1e-6.
+
+        Returns:
+            tuple: The refined (latitude, longitude), the number of iterations taken and the achieved residual.
+        """
+        epoch = self.solar_epoch(local_datetime)
+
+        def residuals(latitude, longitude):
+            calculated_azimuth, calculated_elevation = self.calculate_solar_position(local_datetime, latitude, longitude, epoch=epoch)
+            return (calculated_azimuth - solar_azimuth + 180) % 360 - 180, calculated_elevation - solar_elevation
+
+        latitude, longitude = initial_location
+        azimuth_residual, elevation_residual = residuals(latitude, longitude)
+        residual = abs(azimuth_residual) + abs(elevation_residual)
+
+        iterations = 0
+        while residual > tolerance and iterations < max_iterations:
+            iterations += 1
+
+            # Step the latitude away from the pole so the difference stays on the globe
+            lat_delta = -delta if latitude + delta > 90 else delta
+            azimuth_lat, elevation_lat = residuals(latitude + lat_delta, longitude)
+            azimuth_lon, elevation_lon = residuals(latitude, longitude + delta)
+            d_azimuth_d_lat = ((azimuth_lat - azimuth_residual + 180) % 360 - 180) / lat_delta
+            d_elevation_d_lat = (elevation_lat - elevation_residual) / lat_delta
+            d_azimuth_d_lon = ((azimuth_lon - azimuth_residual + 180) % 360 - 180) / delta
+            d_elevation_d_lon = (elevation_lon - elevation_residual) / delta
+
+            determinant = d_azimuth_d_lat * d_elevation_d_lon - d_azimuth_d_lon * d_elevation_d_lat
+            if determinant == 0:
+                break
+            lat_step = -(d_elevation_d_lon * azimuth_residual - d_azimuth_d_lon * elevation_residual) / determinant
+            lon_step = -(d_azimuth_d_lat * elevation_residual - d_elevation_d_lat * azimuth_residual) / determinant
+
+            # Backtrack until the step improves the residual
+            scale = 1.0
+            while scale > 1e-6:
+                new_latitude = min(max(latitude + scale * lat_step, -90), 90)
+                new_longitude = (longitude + scale * lon_step + 180) % 360 - 180
+                new_azimuth_residual, new_elevation_residual = residuals(new_latitude, new_longitude)
+                if abs(new_azimuth_residual) + abs(new_elevation_residual) < residual:
+                    break
+                scale /= 2
+            else:
+                break
+
+            latitude, longitude = new_latitude, new_longitude
+            azimuth_residual, elevation_residual = new_azimuth_residual, new_elevation_residual
+            residual = abs(azimuth_residual) + abs(elevation_residual)
+
+        return (latitude, longitude), iterations, residual
+
+
+    def geodesic_global_pass(self, local_datetime, solar_azimuth, solar_elevation, step_size=10):
+        """
+        Find the best point of an equal-area Fibonacci lattice over the whole globe.
+
+        Unlike the lat/lon rectangle of find_location, every point covers the same area, so the
+        poles are not oversampled. 10 degree spacing takes 413 points instead of 703 cells.
+
+        Args:
+            local_datetime (datetime): The UTC date and time of the measurement.
+            solar_azimuth (float): The measured solar azimuth angle in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+            step_size (float, optional): The approximate spacing between points in degrees. Defaults to 10.
+
+        Returns:
+            tuple: The latitude and longitude of the best point.
+        """
+        count = int(math.ceil(4 * math.pi / math.radians(step_size) ** 2))
+        latitudes, longitudes = _fibonacci_cap(90, 0, 180, count)
+        residuals = self.residual_from_terms(self.solar_time_terms_array(local_datetime), solar_azimuth, solar_elevation,
+                                             latitudes, longitudes)
+        best = residuals.argmin()
+        return (float(latitudes[best]), float(longitudes[best]))
+
+
+    def refine_location_geodesic(self, local_datetime, solar_azimuth, solar_elevation, location, radius=20,
+                                 shrink=3, min_step=1e-9):
+        """
+        Refine a location with shrinking equal-area caps around the current best point.
+
+        Each level spreads points over a cap of the given radius with a spacing of
+        radius / (2 * shrink), moves to the best one, and shrinks the radius by shrink. Caps
+        are measured on the sphere, so they wrap across the dateline and over the poles instead
+        of being clamped at +-180 longitude like the grid windows.
+
+        Args:
+            local_datetime (datetime): The UTC date and time of the measurement.
+            solar_azimuth (float): The measured solar azimuth angle in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+            location (tuple): The latitude and longitude to start from.
+            radius (float, optional): The radius of the first cap in degrees. Defaults to 20.
+            shrink (float, optional): The factor the radius shrinks by per level. Defaults to 3.
+            min_step (float, optional): The cap radius in degrees to stop at. Defaults to 1e-9.
+
+        Returns:
+            tuple: The refined (latitude, longitude) and the number of levels taken.
+        """
+        terms = self.solar_time_terms_array(local_datetime)
+        count = int(math.ceil(math.pi * (2 * shrink) ** 2))
+        latitude, longitude = location
+
+        levels = 0
+        while radius >= min_step:
+            latitudes, longitudes = _fibonacci_cap(latitude, longitude, radius, count)
+            # Keep the current point as a candidate so the residual never gets worse
+            latitudes = np.append(latitudes, latitude)
+            longitudes = np.append(longitudes, longitude)
+            best = self.residual_from_terms(terms, solar_azimuth, solar_elevation, latitudes, longitudes).argmin()
+            latitude, longitude = float(latitudes[best]), float(longitudes[best])
+            radius /= shrink
+            levels += 1
+
+        return (latitude, longitude), levels
+
+
+    def refine_location(self, local_datetime, solar_azimuth, solar_elevation, location, start_step=10,
+                        engine="grid", tolerance=1e-6, prune_tolerance=None):
+        """
+        Refine a starting location with the newton or grid engine.
+
+        The grid refinement searches +-start_step around the location with steps of start_step / 10,
+        then shrinks the window by a factor of 10 per pass down to 1e-9 degrees. The newton engine
+        tries refine_location_newton first and falls back to the grid refinement if it does not
+        reach the tolerance. The geodesic engine uses refine_location_geodesic with a first
+        cap of 2 * start_step. The kernel engine runs the same grid passes as the grid engine
+        with find_location(engine="kernel").
+
+        Args:
+            local_datetime (datetime): The UTC date and time of the measurement.
+            solar_azimuth (float): The measured solar azimuth angle in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+            location (tuple): The latitude and longitude to start from.
+            start_step (float, optional): The half width of the first grid window in degrees. Defaults to 10.
+            engine (str, optional): "grid", "newton", "geodesic" or "kernel". Defaults to "grid".
+            tolerance (float, optional): The residual the newton engine stops at. Defaults to 1e-6.
+            prune_tolerance (float, optional): Passed to find_location for the grid passes. Defaults to None.
+
+        Returns:
+            tuple: The refined (latitude, longitude), the number of passes or iterations and the
+                   engine that produced it.
+        """
+        if engine == "newton":
+            refined_location, iterations, residual = self.refine_location_newton(local_datetime, solar_azimuth, solar_elevation,
+                                                                                 location, tolerance=tolerance)
+            if residual <= tolerance:
+                return refined_location, iterations, "newton"
+        elif engine == "geodesic":
+            refined_location, iterations = self.refine_location_geodesic(local_datetime, solar_azimuth, solar_elevation,
+                                                                         location, radius=2 * start_step)
+            return refined_location, iterations, "geodesic"
+        else:
+            iterations = 0
+
+        grid_engine = "kernel" if engine == "kernel" else "grid"
+        closest_location = location
+        i = start_step
+        while i >= 10/(10**10):
+            closest_location = self.find_location(local_datetime, solar_azimuth, solar_elevation, lat_min = max((closest_location[0] - i), -90),
+                                                                                                    lat_max = min((closest_location[0] + i), 90),
+                                                                                                    lon_min = max((closest_location[1] - i), -180),
+                                                                                                    lon_max = min((closest_location[1] + i), 180),
+                                                                                                    step_size = i / 10,
+                                                                                                    engine = grid_engine,
+                                                                                                    prune_tolerance = prune_tolerance)
+            iterations += 1
+            i /= 10
+
+        return closest_location, iterations, grid_engine
+
+
+    def locate(self, local_datetime, solar_azimuth, solar_elevation, engine="grid", tolerance=1e-6, return_info=False,
+               warm_start=None, warm_start_window=5, warm_start_residual=1e-6, prune_tolerance=None):
+        """
+        Find the location whose solar azimuth and elevation best match the given values.
+
+        The grid engine runs find_location over the whole globe with 10 degree steps and then
+        refines around the best cell with steps shrinking by a factor of 10 down to 1e-9 degrees.
+        The analytic engine solves the position directly and falls back to the grid engine when
+        the measurement has no exact solution. The newton engine refines the best 10 degree cell
+        with refine_location_newton and falls back to the grid refinement if it does not reach
+        the tolerance. The geodesic engine replaces the lat/lon rectangles with an equal-area
+        Fibonacci lattice (geodesic_global_pass) and spherical caps (refine_location_geodesic),
+        which needs fewer evaluations and has no seam at the dateline. The kernel engine runs the
+        grid engine's passes through the fused solar_kernels.grid_argmin loop (compiled with Numba
+        when it is installed).
+
+        With a warm start (e.g. the solution of the unperturbed measurement, or of a neighbouring
+        sample) the global 10 degree pass is skipped and only a +-warm_start_window window around
+        it is refined. If that leaves a residual above warm_start_residual the global search runs
+        as usual.
+
+        Args:
+            local_datetime (datetime): The UTC date and time of the measurement.
+            solar_azimuth (float): The measured solar azimuth angle in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+            engine (str, optional): "grid", "analytic", "newton", "geodesic" or "kernel". Defaults to "grid".
+            tolerance (float, optional): The residual the newton engine stops at. Defaults to 1e-6.
+            return_info (bool, optional): Also return a dict with the engine that produced the
+                                          result, the number of passes or iterations, whether the
+                                          warm start was used and the achieved residual. Defaults to False.
+            warm_start (tuple, optional): A latitude and longitude to seed the search from. Defaults to None.
+            warm_start_window (float, optional): The half width in degrees of the warm started window. Defaults to 5.
+            warm_start_residual (float, optional): The residual in degrees above which a warm started
+                                                   result is discarded for a global search. Defaults to 1e-6.
+            prune_tolerance (float, optional): The sensor error in degrees around the circle of equal
+                                               elevation outside which the grid passes skip cells. Defaults
+                                               to None, which evaluates every cell.
+
+        Returns:
+            tuple: The latitude and longitude of the closest location (and the info dict if return_info is set).
+        """
+        if engine not in ("grid", "analytic", "newton", "geodesic", "kernel"):
+            raise ValueError(f"Unknown engine: {engine}")
+
+        info = {"engine": engine, "iterations": 0, "warm_start": False}
+        closest_location = None
+
+        if engine == "analytic":
+            closest_location = self.solve_location_analytic(local_datetime, solar_azimuth, solar_elevation)
+            refine_engine = "grid"
+        else:
+            refine_engine = engine
+
+        if closest_location is None and warm_start is not None:
+            location, iterations, info["engine"] = self.refine_location(local_datetime, solar_azimuth, solar_elevation, warm_start,
+                                                                        start_step=warm_start_window, engine=refine_engine,
+                                                                        tolerance=tolerance, prune_tolerance=prune_tolerance)
+            info["iterations"] += iterations
+            if self.location_residual(local_datetime, solar_azimuth, solar_elevation, location) <= warm_start_residual:
+                closest_location = location
+                info["warm_start"] = True
+
+        if closest_location is None:
+            if engine == "geodesic":
+                closest_location = self.geodesic_global_pass(local_datetime, solar_azimuth, solar_elevation)
+            else:
+                closest_location = self.find_location(local_datetime, solar_azimuth, solar_elevation, lat_min = -90,
+                                                                                                        lat_max = 90,
+                                                                                                        lon_min = -180,
+                                                                                                        lon_max = 180,
+                                                                                                        step_size = 10,
+                                                                                                        engine = "kernel" if engine == "kernel" else "grid",
+                                                                                                        prune_tolerance = prune_tolerance)
+            closest_location, iterations, info["engine"] = self.refine_location(local_datetime, solar_azimuth, solar_elevation,
+                                                                                closest_location, engine=refine_engine,
+                                                                                tolerance=tolerance, prune_tolerance=prune_tolerance)
+            info["iterations"] += 1 + iterations
+
+        if return_info:
+            info["residual"] = self.location_residual(local_datetime, solar_azimuth, solar_elevation, closest_location)
+            return closest_location, info
+        return closest_location
+
 
     def find_location(self, local_datetime, solar_azimuth, solar_elevation, lat_min,
-                                                                            lat_max, 
-                                                                            lon_min, 
+                                                                            lat_max,
+                                                                            lon_min,
                                                                             lon_max,
-                                                                            step_size):
+                                                                            step_size,
+                                                                            engine="grid",
+                                                                            prune_tolerance=None):
         """
         Find the locations with the closest solar azimuth and elevation angles to the given values.
 
@@ -144,13 +816,70 @@ class functions:
             local_datetime (datetime): The local date and time for which to find the locations.
             solar_azimuth (float): The desired solar azimuth angle in degrees.
             solar_elevation (float): The desired solar elevation angle in degrees.
+            engine (str, optional): "grid" evaluates every cell of the lat/lon window. "analytic" returns
+                                    the closed form solution when it lies inside the window and otherwise
+                                    falls back to the grid. "kernel" evaluates the same cells with the fused
+                                    solar_kernels.grid_argmin loop, which compares azimuths wrapped to +-180.
+                                    Defaults to "grid".
+            prune_tolerance (float, optional): Only evaluate cells within this many degrees (plus the step
+                                               size) of the circle of equal elevation, see find_locations.
+                                               Not used by the kernel engine. Defaults to None, which
+                                               evaluates every cell.
 
         Returns:
             list: A list of tuples containing the latitude and longitude of the closest locations.
         """
+        if engine == "analytic":
+            location = self.solve_location_analytic(local_datetime, solar_azimuth, solar_elevation)
+            if location is not None and lat_min <= location[0] <= lat_max and lon_min <= location[1] <= lon_max:
+                return location
+        elif engine == "kernel":
+            epoch = self.solar_epoch(local_datetime)
+            latitudes = lat_min + step_size * np.arange(int(math.floor((lat_max - lat_min) / step_size + 1e-9)) + 1)
+            longitudes = lon_min + step_size * np.arange(int(math.floor((lon_max - lon_min) / step_size + 1e-9)) + 1)
+            lat_index, lon_index, _ = solar_kernels.grid_argmin(epoch.declination_angle, epoch.EoT, epoch.minute_of_day,
+                                                                latitudes, longitudes, solar_azimuth, solar_elevation)
+            return (float(latitudes[lat_index]), float(longitudes[lon_index]))
+        elif engine != "grid":
+            raise ValueError(f"Unknown engine: {engine}")
+
+        return self.find_locations(local_datetime, solar_azimuth, solar_elevation, lat_min, lat_max, lon_min, lon_max, step_size,
+                                   prune_tolerance=prune_tolerance)[0][0]
+
+
+    def find_locations(self, local_datetime, solar_azimuth, solar_elevation, lat_min,
+                                                                             lat_max,
+                                                                             lon_min,
+                                                                             lon_max,
+                                                                             step_size,
+                                                                             max_locations=1,
+                                                                             prune_tolerance=None):
+        """
+        Find the grid cells with the closest solar azimuth and elevation angles to the given values.
+
+        A measured elevation puts the observer on a circle of radius 90 - elevation around the
+        subsolar point. With prune_tolerance set, each latitude row only evaluates the longitudes
+        within prune_tolerance + step_size degrees of that circle (see feasible_longitude_range).
+        If no cell of the window is feasible, every cell is evaluated as usual.
+
+        Args:
+            local_datetime (datetime): The local date and time for which to find the locations.
+            solar_azimuth (float): The desired solar azimuth angle in degrees.
+            solar_elevation (float): The desired solar elevation angle in degrees.
+            lat_min, lat_max, lon_min, lon_max (float): The bounds of the window to search.
+            step_size (float): The spacing of the grid in degrees.
+            max_locations (int, optional): How many of the closest cells to keep. Defaults to 1.
+            prune_tolerance (float, optional): The sensor error in degrees allowed around the circle of
+                                               equal elevation. Defaults to None, which disables pruning.
+
+        Returns:
+            list: Up to max_locations tuples of ((latitude, longitude), weighted_difference), closest first.
+        """
         # Convert local datetime to UTC
-        utc_datetime = local_datetime.tz_localize('UTC')
+        utc_datetime = local_datetime.replace(tzinfo=timezone.utc)
         # print(utc_datetime)
+        # The declination and equation of time are the same for every cell of the search
+        epoch = self.solar_epoch(utc_datetime)
 
         # Define a range of latitudes and longitudes
         latitudes = []  
@@ -169,19 +898,30 @@ class functions:
             lon += step_size
 
 
-        # Initialize variables to track the closest locations and their corresponding azimuth and altitude
-        closest_locations = []
-        closest_azimuths = []
-        closest_altitudes = []
-        closest_weighted_differences = []
-        max_locations = 1
-        min_weighted_differences = [float('inf')] * max_locations
+        # Bounded max-heap of the closest cells, stored as (-weighted_difference, -order, location) so
+        # the worst kept cell sits on top and, between equal differences, the later cell is dropped first
+        closest = []
+        order = 0
+
+        if prune_tolerance is not None:
+            subsolar_longitude = self.subsolar_point(utc_datetime)[1]
 
         # Iterate over latitudes and longitudes
         for latitude in latitudes:
+            if prune_tolerance is not None:
+                longitude_range = self.feasible_longitude_range(epoch, latitude, solar_elevation, prune_tolerance + step_size)
+                if longitude_range is None:
+                    continue
+
             for longitude in longitudes:
+                if prune_tolerance is not None:
+                    # Skip cells off the circle of equal elevation without any trig
+                    longitude_difference = abs((longitude - subsolar_longitude + 180) % 360 - 180)
+                    if not longitude_range[0] <= longitude_difference <= longitude_range[1]:
+                        continue
+
                 # Calculate solar position for the current UTC datetime and location
-                calculated_azimuth, calculated_elevation = self.calculate_solar_position(utc_datetime, latitude, longitude)
+                calculated_azimuth, calculated_elevation = self.calculate_solar_position(utc_datetime, latitude, longitude, epoch=epoch)
 
                 # Calculate the difference between calculated and provided angles
                 azimuth_difference = abs(calculated_azimuth - solar_azimuth)
@@ -190,26 +930,365 @@ class functions:
                 # Calculate the weighted difference
                 weighted_difference = 1 * azimuth_difference + 1 * elevation_difference
 
-                # Check if the current location is among the top five closest
-                for i in range(max_locations):
-                    if weighted_difference < min_weighted_differences[i]:
-                        min_weighted_differences.insert(i, weighted_difference)
-                        min_weighted_differences = min_weighted_differences[:max_locations]
-                        closest_locations.insert(i, (latitude, longitude))
-                        closest_azimuths.insert(i, calculated_azimuth)
-                        closest_altitudes.insert(i, calculated_elevation)
-                        closest_weighted_differences.insert(i, weighted_difference)
-                        closest_locations = closest_locations[:max_locations]
-                        closest_azimuths = closest_azimuths[:max_locations]
-                        closest_altitudes = closest_altitudes[:max_locations]
-                        closest_weighted_differences = closest_weighted_differences[:max_locations]
+                # Check if the current location is among the closest max_locations
+                order += 1
+                if len(closest) < max_locations:
+                    heapq.heappush(closest, (-weighted_difference, -order, (latitude, longitude)))
+                elif weighted_difference < -closest[0][0]:
+                    heapq.heapreplace(closest, (-weighted_difference, -order, (latitude, longitude)))
+
+        if not closest:
+            return self.find_locations(local_datetime, solar_azimuth, solar_elevation, lat_min, lat_max, lon_min, lon_max,
+                                       step_size, max_locations=max_locations)
+
+        return [(location, -negative_difference) for negative_difference, _, location in sorted(closest, reverse=True)]
+
+
+    def residual_from_terms(self, terms, solar_azimuths, solar_elevations, latitudes, longitudes):
+        """
+        Calculate the azimuth/elevation residual for arrays of candidate locations.
+
+        Args:
+            terms (tuple): The declination, equation of time and minute of day from solar_time_terms_array.
+            solar_azimuths (float or numpy.ndarray): The measured solar azimuths in degrees.
+            solar_elevations (float or numpy.ndarray): The measured solar elevations in degrees.
+            latitudes (numpy.ndarray): The candidate latitudes in degrees.
+            longitudes (numpy.ndarray): The candidate longitudes in degrees.
+
+        Returns:
+            numpy.ndarray: The absolute azimuth difference (wrapped to +-180) plus the absolute elevation
+                           difference in degrees, broadcast over all the inputs.
+        """
+        calculated_azimuth, calculated_elevation = self.solar_position_from_terms(*terms, latitudes, longitudes)
+        return (np.abs((calculated_azimuth - solar_azimuths + 180) % 360 - 180) +
+                np.abs(calculated_elevation - solar_elevations))
+
+
+    def refine_locations_array(self, terms, solar_azimuths, solar_elevations, latitudes, longitudes, start_step=10):
+        """
+        Run the coarse-to-fine grid refinement for many starting locations at once.
+
+        Each location is refined with a 21x21 window of +-step that shrinks by a factor of 10
+        per pass down to 1e-9 degrees, like locate, but all of the windows are evaluated as one
+        stacked array. Latitudes are clamped to the poles and longitudes wrap at the dateline.
+
+        Args:
+            terms (tuple): The declination, equation of time and minute of day from solar_time_terms_array,
+                           either scalars or arrays of shape (M,).
+            solar_azimuths (float or numpy.ndarray): The measured solar azimuths in degrees, scalar or shape (M,).
+            solar_elevations (float or numpy.ndarray): The measured solar elevations in degrees, scalar or shape (M,).
+            latitudes (numpy.ndarray): The M starting latitudes in degrees.
+            longitudes (numpy.ndarray): The M starting longitudes in degrees.
+            start_step (float, optional): The half width of the first window in degrees. Defaults to 10.
+
+        Returns:
+            tuple: Arrays of the M refined latitudes, longitudes and their residuals.
+        """
+        def expand(value):
+            return np.asarray(value, dtype=float)[..., None, None]
+
+        window_terms = tuple(expand(term) for term in terms)
+        window_azimuths = expand(solar_azimuths)
+        window_elevations = expand(solar_elevations)
+        latitudes = np.array(latitudes, dtype=float)
+        longitudes = np.array(longitudes, dtype=float)
+        offsets = np.arange(-10, 11) / 10
+
+        i = start_step
+        while i >= 10/(10**10):
+            window_latitudes = np.clip(latitudes[:, None, None] + i * offsets[None, :, None], -90, 90)
+            window_longitudes = (longitudes[:, None, None] + i * offsets[None, None, :] + 180) % 360 - 180
+            residuals = self.residual_from_terms(window_terms, window_azimuths, window_elevations,
+                                                 window_latitudes, window_longitudes)
+
+            best = residuals.reshape(len(latitudes), -1).argmin(axis=1)
+            lat_index, lon_index = np.unravel_index(best, residuals.shape[1:])
+            latitudes = window_latitudes[np.arange(len(latitudes)), lat_index, 0]
+            longitudes = window_longitudes[np.arange(len(longitudes)), 0, lon_index]
+            i /= 10
+
+        residuals = self.residual_from_terms(terms, solar_azimuths, solar_elevations, latitudes, longitudes)
+        return latitudes, longitudes, residuals
+
+
+    def locate_batch(self, datetimes, solar_azimuths, solar_elevations, engine="grid", chunk_size=1024,
+                     warm_starts=None, warm_start_window=5, warm_start_residual=1e-6):
+        """
+        Find the locations for many measurements in one call.
+
+        The grid engine scores the 10 degree global grid for a whole chunk of observations as one
+        (chunk, 19, 37) array, then refines every observation together with refine_locations_array.
+        The analytic engine solves all observations with solve_location_analytic_array and only
+        sends the ones without an exact solution through the grid engine.
+
+        With warm_starts every observation is first refined from its own seed within
+        +-warm_start_window, and only the ones left with a residual above warm_start_residual
+        go through the global grid pass.
+
+        Args:
+            datetimes (datetime or array-like): The UTC date(s) and time(s) of the measurements.
+            solar_azimuths (array-like): The N measured solar azimuths in degrees.
+            solar_elevations (array-like): The N measured solar elevations in degrees.
+            engine (str, optional): "grid" or "analytic". Defaults to "grid".
+            chunk_size (int, optional): The number of observations scored per grid array, bounding
+                                        memory use. Defaults to 1024.
+            warm_starts (array-like, optional): An N x 2 (or 1 x 2) array of latitudes and longitudes to seed
+                                                each observation from. Defaults to None.
+            warm_start_window (float, optional): The half width in degrees of the warm started window. Defaults to 5.
+            warm_start_residual (float, optional): The residual in degrees above which a warm started
+                                                   result is discarded for a global search. Defaults to 1e-6.
+
+        Returns:
+            numpy.ndarray: An N x 2 array of latitudes and longitudes.
+        """
+        if engine not in ("grid", "analytic"):
+            raise ValueError(f"Unknown engine: {engine}")
+
+        solar_azimuths = np.atleast_1d(np.asarray(solar_azimuths, dtype=float))
+        solar_elevations = np.atleast_1d(np.asarray(solar_elevations, dtype=float))
+        solar_azimuths, solar_elevations = np.broadcast_arrays(solar_azimuths, solar_elevations)
+        terms = tuple(np.broadcast_to(term, solar_azimuths.shape)
+                      for term in self.solar_time_terms_array(datetimes))
+
+        locations = np.full((len(solar_azimuths), 2), np.nan)
+        if engine == "analytic":
+            locations[:, 0], locations[:, 1] = self.solve_location_analytic_array(
+                _as_datetime64(datetimes), solar_azimuths, solar_elevations)
+
+        unsolved = np.flatnonzero(np.isnan(locations[:, 0]))
+        if warm_starts is not None and len(unsolved):
+            seeds = np.broadcast_to(np.asarray(warm_starts, dtype=float).reshape(-1, 2), locations.shape)[unsolved]
+            latitudes, longitudes, residuals = self.refine_locations_array(
+                tuple(term[unsolved] for term in terms), solar_azimuths[unsolved], solar_elevations[unsolved],
+                seeds[:, 0], seeds[:, 1], start_step=warm_start_window)
+            accepted = residuals <= warm_start_residual
+            locations[unsolved[accepted], 0] = latitudes[accepted]
+            locations[unsolved[accepted], 1] = longitudes[accepted]
+            unsolved = unsolved[~accepted]
+
+        latitudes = np.arange(-90, 90 + 5, 10)
+        longitudes = np.arange(-180, 180 + 5, 10)
+        for start in range(0, len(unsolved), chunk_size):
+            chunk = unsolved[start:start + chunk_size]
+            chunk_terms = tuple(term[chunk] for term in terms)
+
+            residuals = self.residual_from_terms(tuple(term[:, None, None] for term in chunk_terms),
+                                                 solar_azimuths[chunk, None, None], solar_elevations[chunk, None, None],
+                                                 latitudes[None, :, None], longitudes[None, None, :])
+            lat_index, lon_index = np.unravel_index(residuals.reshape(len(chunk), -1).argmin(axis=1), residuals.shape[1:])
+
+            locations[chunk, 0], locations[chunk, 1], _ = self.refine_locations_array(
+                chunk_terms, solar_azimuths[chunk], solar_elevations[chunk], latitudes[lat_index], longitudes[lon_index])
+
+        return locations
+
+
+    def locate_top_k(self, local_datetime, solar_azimuth, solar_elevation, k=3, step_size=10, residual_margin=1,
+                     tolerance=1e-6):
+        """
+        Find up to k distinct locations matching the given solar azimuth and elevation.
+
+        The coarse pass evaluates the whole globe as one array and keeps the k best local minima
+        (cells no worse than their 8 neighbours, with longitude wrapping at the dateline), picked
+        with argpartition, where each pole row counts as a single cell. All k hypotheses are then refined
+        in parallel with refine_locations_array and finished one by one with refine_location's newton
+        engine (which falls back to the grid refinement), and the ones left more than residual_margin
+        above the best residual are dropped as wrong basins. This recovers the second solution for a low
+        sun and for azimuths near +-180, where a single coarse cell can lock onto the wrong basin.
+
+        Args:
+            local_datetime (datetime): The UTC date and time of the measurement.
+            solar_azimuth (float): The measured solar azimuth angle in degrees.
+            solar_elevation (float): The measured solar elevation angle in degrees.
+            k (int, optional): The maximum number of hypotheses to return. Defaults to 3.
+            step_size (float, optional): The spacing of the coarse grid in degrees. Defaults to 10.
+            residual_margin (float, optional): The degrees of residual above the best hypothesis up to which
+                                               others are kept. Defaults to 1.
+            tolerance (float, optional): The residual at which a hypothesis counts as converged. Defaults to 1e-6.
+
+        Returns:
+            list: Tuples of ((latitude, longitude), residual, converged) ranked by residual, closest first,
+                  where converged tells an exact solution (a real ambiguity) from a minimum that only
+                  comes close. Hypotheses that refine to the same location are only returned once.
+        """
+        terms = self.solar_time_terms_array(local_datetime)
+        latitudes = np.arange(-90, 90 + step_size / 2, step_size)
+        longitudes = np.arange(-180, 180, step_size)
+        residuals = self.residual_from_terms(terms, solar_azimuth, solar_elevation,
+                                             latitudes[:, None], longitudes[None, :])
+
+        # Local minima of the coarse grid, longitude is periodic. A pole row is one point, so it counts
+        # as a single cell (its best longitude) and there is nothing beyond the edge of the grid
+        poles = [row for row in (0, len(latitudes) - 1) if abs(latitudes[row]) == 90]
+        edges = [np.full(len(longitudes), residuals[row].min() if row in poles else np.inf)
+                 for row in (0, len(latitudes) - 1)]
+        padded = np.vstack((edges[0], residuals, edges[1]))
+        for row in poles:
+            padded[1 + row] = residuals[row].min()
+        local_minimum = np.ones(residuals.shape, dtype=bool)
+        for lat_shift in (-1, 0, 1):
+            for lon_shift in (-1, 0, 1):
+                if lat_shift == 0 and lon_shift == 0:
+                    continue
+                neighbour = np.roll(padded, lon_shift, axis=1)[1 + lat_shift:len(padded) - 1 + lat_shift]
+                local_minimum &= residuals <= neighbour
+        for row in poles:
+            neighbour_row = 1 if row == 0 else row - 1
+            best = np.argmin(residuals[row])
+            local_minimum[row] = False
+            local_minimum[row, best] = residuals[row, best] <= residuals[neighbour_row].min()
+
+        candidates = np.flatnonzero(local_minimum)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(residuals.ravel()[candidates], k - 1)[:k]]
+        lat_index, lon_index = np.unravel_index(candidates, residuals.shape)
+
+        refined_latitudes, refined_longitudes, _ = self.refine_locations_array(
+            terms, solar_azimuth, solar_elevation, latitudes[lat_index], longitudes[lon_index], start_step=step_size)
+
+        # The scalar refinements read the hour and minute off a datetime
+        moment = _as_datetime64(local_datetime).ravel()[0].astype(object)
+        finished = []
+        for latitude, longitude in zip(refined_latitudes.tolist(), refined_longitudes.tolist()):
+            location, _, _ = self.refine_location(moment, solar_azimuth, solar_elevation, (latitude, longitude),
+                                                  start_step=step_size / 10, engine="newton", tolerance=tolerance)
+            finished.append((location, self.location_residual(moment, solar_azimuth, solar_elevation, location)))
+
+        best = min(residual for _, residual in finished)
+        hypotheses = []
+        for (latitude, longitude), residual in sorted(finished, key=lambda hypothesis: hypothesis[1]):
+            if residual > best + residual_margin:
+                break
+            location = (float(latitude), float(longitude))
+            # Newton stops at the tolerance, so copies of one solution can differ by a few 1e-6 degrees
+            if any(abs(location[0] - other[0]) < 1e-3 and abs((location[1] - other[1] + 180) % 360 - 180) < 1e-3
+                   for other, _, _ in hypotheses):
+                continue
+            hypotheses.append((location, float(residual), residual <= tolerance))
+        return hypotheses
 
-        # Print the closest locations and their corresponding azimuth and altitude
-        # print(step_size)
-        # for location, azimuth, altitude, weighted_difference in zip(closest_locations, closest_azimuths, closest_altitudes, closest_weighted_differences):
-        #     print(f"Location: {location}, Azimuth: {azimuth:.2f}, Altitude: {altitude:.2f}, Weighted Difference: {weighted_difference:.6f}")
 
-        return closest_locations[0]
+def parse_observation(record, calculator, intended_lat_lon=None):
+    """
+    Read one measurement in the JSON form of solve_jsonl.
+
+    Args:
+        record (dict): "time" and "az" and either "el" or "height" and "shadow", with optional "lat" and
+                       "lon" of the intended location and an "id" that is passed through.
+        calculator (functions): The calculator, used for shadow measurements.
+        intended_lat_lon (tuple, optional): The intended location if the record has none. Defaults to None.
+
+    Returns:
+        dict: The "id", "time" (numpy.datetime64), "az" and "el" of the measurement, and "intended_lat_lon" if known.
+              A time with a UTC offset keeps its wall clock time, as in _as_datetime64.
+
+    Raises:
+        ValueError, KeyError or TypeError: If the record is not a valid measurement, including NaN or infinite numbers
+                                           and a latitude without a longitude or the other way around.
+    """
+    if not isinstance(record, dict):
+        raise TypeError("each measurement must be a JSON object")
+    if ("lat" in record) != ("lon" in record):
+        raise ValueError("lat and lon must be given together")
+    if intended_lat_lon is not None and None in tuple(intended_lat_lon):
+        raise ValueError("the intended location needs both a latitude and a longitude")
+    names = ("az", "el") if "el" in record else ("az", "height", "shadow")
+    names += ("lat", "lon") if "lat" in record and "lon" in record else ()
+    values = {name: float(record[name]) for name in names}
+    for name, value in values.items():
+        if not math.isfinite(value):
+            raise ValueError(f"{name} must be a finite number")
+
+    if "el" in values:
+        solar_elevation = values["el"]
+    else:
+        solar_elevation = calculator.calculate_solar_elevation_from_shadow(values["height"], values["shadow"])
+        if solar_elevation is None:
+            raise ValueError("height and shadow must be positive")
+    if "lat" in values:
+        intended_lat_lon = (values["lat"], values["lon"])
+
+    observation = {"id": record.get("id"), "time": _as_datetime64(datetime.datetime.fromisoformat(str(record["time"])))[()],
+                   "az": values["az"], "el": solar_elevation}
+    if intended_lat_lon is not None:
+        observation["intended_lat_lon"] = list(intended_lat_lon)
+    return observation
+
+
+def solve_observations(observations, calculator, engine="grid"):
+    """
+    Solve measurements from parse_observation together with locate_batch, filling in their results.
+
+    Args:
+        observations (list): The dicts from parse_observation.
+        calculator (functions): The calculator to solve with.
+        engine (str, optional): "grid" or "analytic", see locate_batch. Defaults to "grid".
+
+    Returns:
+        list: The same dicts with "time" as a string, the solved "latitude" and "longitude", the "residual"
+              in degrees and, with an intended location, the "distance" to it in miles.
+    """
+    if not observations:
+        return observations
+    datetimes = np.array([observation["time"] for observation in observations])
+    azimuths = np.array([observation["az"] for observation in observations])
+    elevations = np.array([observation["el"] for observation in observations])
+    locations = calculator.locate_batch(datetimes, azimuths, elevations, engine=engine)
+    residuals = calculator.residual_from_terms(calculator.solar_time_terms_array(datetimes), azimuths, elevations,
+                                               locations[:, 0], locations[:, 1])
+    for observation, location, residual in zip(observations, locations.tolist(), residuals.tolist()):
+        observation["time"] = str(observation["time"]).replace("T", " ")
+        observation["latitude"], observation["longitude"] = location
+        observation["residual"] = residual
+
+    intended = [observation for observation in observations if "intended_lat_lon" in observation]
+    if intended:
+        # Only loaded when a distance is asked for
+        from haversine import haversine_vector, Unit
+
+        distances = haversine_vector([observation["intended_lat_lon"] for observation in intended],
+                                     [(observation["latitude"], observation["longitude"]) for observation in intended],
+                                     unit=Unit.MILES)
+        for observation, distance in zip(intended, distances.tolist()):
+            observation["distance"] = distance
+    return observations
+
+
+def solve_jsonl(lines, calculator=None, engine="grid", batch_size=1024, intended_lat_lon=None):
+    """
+    Solve a stream of JSON line measurements in batches with solve_observations.
+
+    Each line holds one measurement in the form read by parse_observation. Lines are read and answered
+    one batch at a time, in order, so any number of lines can be streamed. A line that cannot be read
+    is answered with its line number and the error.
+
+    Args:
+        lines (iterable): The JSON lines, e.g. an open file or sys.stdin.
+        calculator (functions, optional): The calculator to solve with. Defaults to None, a new one.
+        engine (str, optional): "grid" or "analytic", see locate_batch. Defaults to "grid".
+        batch_size (int, optional): The measurements solved together. Defaults to 1024.
+        intended_lat_lon (tuple, optional): The intended location of lines without their own. Defaults to None.
+
+    Yields:
+        dict: The result of each line, see solve_observations.
+    """
+    if calculator is None:
+        calculator = functions()
+
+    batch = []
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            batch.append(parse_observation(json.loads(line), calculator, intended_lat_lon))
+        except (ValueError, KeyError, TypeError) as e:
+            batch.append({"line": line_number, "error": str(e)})
+        if len(batch) >= batch_size:
+            solve_observations([observation for observation in batch if "error" not in observation], calculator, engine)
+            yield from batch
+            batch = []
+    solve_observations([observation for observation in batch if "error" not in observation], calculator, engine)
+    yield from batch
 
 
 # Sample implementation
@@ -225,13 +1304,15 @@ if __name__ == "__main__":
     solar_elevation = None
     intended_latitude = None
     intended_longitude = None
+    engine = "grid"
+    tolerance = 1e-6
+    top_k = None
+    prune_tolerance = None
+    jsonl_source = None
+    batch_size = 1024
 
     mode = None
 
-    for i in sys.argv:
-        print(i)
-
-    
     i = 1
     while i < len(sys.argv):
         if(sys.argv[i] == "-name" and i < len(sys.argv) - 1):
@@ -260,11 +1341,64 @@ if __name__ == "__main__":
         elif(sys.argv[i] == "-lon" and i < len(sys.argv) - 1):
             i += 1
             intended_longitude = float(sys.argv[i])
+        elif(sys.argv[i] == "-engine" and i < len(sys.argv) - 1):
+            i += 1
+            engine = str(sys.argv[i])
+        elif(sys.argv[i] == "-tolerance" and i < len(sys.argv) - 1):
+            i += 1
+            tolerance = float(sys.argv[i])
+        elif(sys.argv[i] == "-top" and i < len(sys.argv) - 1):
+            i += 1
+            top_k = int(sys.argv[i])
+        elif(sys.argv[i] == "-prune" and i < len(sys.argv) - 1):
+            i += 1
+            prune_tolerance = float(sys.argv[i])
+        elif(sys.argv[i] == "-jsonl" and i < len(sys.argv) - 1):
+            i += 1
+            jsonl_source = str(sys.argv[i])
+        elif(sys.argv[i] == "-batch" and i < len(sys.argv) - 1):
+            i += 1
+            batch_size = int(sys.argv[i])
         else:
             print("ERROR: Invalid usage")
             sys.exit(1)
         i += 1
 
+    if (intended_latitude is None) != (intended_longitude is None):
+        # The distance to the intended location needs both halves of it
+        print("ERROR: Invalid usage, -lat and -lon must be given together")
+        sys.exit(1)
+
+    if jsonl_source is not None:
+        # Streaming mode: JSON lines in, JSON lines out, and a map only when -name is given
+        intended_lat_lon = (intended_latitude, intended_longitude) if intended_latitude is not None else None
+        source = sys.stdin if jsonl_source == "-" else open(jsonl_source, "r")
+        solved = []
+        with source:
+            for result in solve_jsonl(source, calculator, engine=engine, batch_size=batch_size, intended_lat_lon=intended_lat_lon):
+                sys.stdout.write(json.dumps(result) + "\n")
+                if filename is not None and "error" not in result:
+                    solved.append((result["latitude"], result["longitude"]))
+        sys.stdout.flush()
+
+        if filename is not None and solved:
+            import folium
+            from folium.plugins import HeatMap
+
+            mymap = folium.Map(location=list(np.mean(solved, axis=0)), zoom_start=3)
+            HeatMap(solved).add_to(mymap)
+            mymap.save("Single_run_results/" + filename)
+        sys.exit(0)
+
+    # The solver only needs NumPy, the single observation mode and its map load the rest
+    import pandas as pd
+    import folium
+    import webbrowser
+    from haversine import haversine, Unit
+
+    for i in sys.argv:
+        print(i)
+
     print(filename,
             datetime_value,
             height_of_object,
@@ -296,23 +1430,16 @@ if __name__ == "__main__":
         print("Estimated solar elevation angle:", target_elevation, "degrees")
         solar_elevation = target_elevation  
     
-    closest_location = calculator.find_location(datetime_value, solar_azimuth, solar_elevation, lat_min = -90,
-                                                                                                lat_max = 90, 
-                                                                                                lon_min = -180, 
-                                                                                                lon_max = 180,
-                                                                                                step_size = 10)
-    
-
-    i = 10
-    while i >= 10/(10**10):    
-        closest_location = calculator.find_location(datetime_value, solar_azimuth, solar_elevation, lat_min = max((closest_location[0] - i), -90),
-                                                                                                    lat_max = min((closest_location[0] + i), 90), 
-                                                                                                    lon_min = max((closest_location[1] - i), -180), 
-                                                                                                    lon_max = min((closest_location[1] + i), 180),
-                                                                                                    step_size = i / 10)
-        i /= 10
+    closest_location, solve_info = calculator.locate(datetime_value, solar_azimuth, solar_elevation, engine=engine,
+                                                     tolerance=tolerance, prune_tolerance=prune_tolerance,
+                                                     return_info=True)
 
     print("Closest location:", closest_location)
+    print(f"Solved by {solve_info['engine']} in {solve_info['iterations']} iterations with residual {solve_info['residual']}")
+
+    if top_k is not None:
+        for rank, (location, residual, converged) in enumerate(calculator.locate_top_k(datetime_value, solar_azimuth, solar_elevation, k=top_k), 1):
+            print(f"Hypothesis {rank}: {location} with residual {residual}{'' if converged else ' (not converged)'}")
 
     closest = closest_location
     map_center = closest
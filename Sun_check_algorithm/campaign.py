@@ -0,0 +1,258 @@
+import os
+import json
+import datetime
+import numpy as np
+import pandas as pd
+
+# Name of the manifest in a Tests/<time_stamp> directory
+MANIFEST_NAME = "campaign.json"
+# Directory of the completion markers and chunk checkpoints inside a campaign
+CHECKPOINT_DIRECTORY = "checkpoints"
+
+
+def new_seed():
+    """
+    Returns:
+        int: A fresh campaign seed from the operating system's entropy.
+    """
+    return int(np.random.SeedSequence().entropy)
+
+
+def locations_seed(seed):
+    """
+    Derive the seed of the random target locations from the campaign seed, apart from every target seed.
+
+    Args:
+        seed (int): The campaign seed.
+
+    Returns:
+        int: The seed for random_location_Generator.random_locations.
+    """
+    return int(np.random.SeedSequence(seed).generate_state(1)[0])
+
+
+def derive_seed(seed, index):
+    """
+    Derive the independent seed of one target from the campaign seed.
+
+    Args:
+        seed (int): The campaign seed.
+        index (int): The index of the target.
+
+    Returns:
+        int: The target seed.
+    """
+    return int(np.random.SeedSequence(seed, spawn_key=(index,)).generate_state(1)[0])
+
+
+class Campaign:
+    """
+    The manifest, completion markers and chunk checkpoints of one Tests/<time_stamp> run.
+
+    The manifest records the campaign seed, the settings and every target with its derived seed, so a
+    resumed campaign solves exactly the targets and samples of the first run. A target is finished once
+    its marker exists, and the rows of each finished chunk are kept until then so a resumed scheduled
+    run only solves the chunks that were lost.
+    """
+
+    def __init__(self, directory, manifest):
+        """
+        Args:
+            directory (str): The campaign directory, e.g. Tests/<time_stamp>.
+            manifest (dict): The manifest, see create.
+        """
+        self.directory = directory
+        self.manifest = manifest
+
+
+    @classmethod
+    def create(cls, directory, tests, percent_error, seed=None, settings=None):
+        """
+        Start a campaign and write its manifest.
+
+        Args:
+            directory (str): The campaign directory.
+            tests (list): The targets, tuples of the run_test arguments.
+            percent_error (float): The largest error in degrees of every target.
+            seed (int, optional): The campaign seed. Defaults to None, a fresh one that is recorded.
+            settings (dict, optional): Extra options to record, such as the run mode. Defaults to None.
+
+        Returns:
+            Campaign: The new campaign.
+        """
+        if seed is None:
+            seed = new_seed()
+        manifest = {
+            "seed": seed,
+            "created": datetime.datetime.now().isoformat(),
+            "percent_error": percent_error,
+            "settings": settings or {},
+            "targets": [{
+                "datetime": str(datetime_value),
+                "solar_azimuth": solar_azimuth,
+                "solar_elevation": solar_elevation,
+                "intended_lat_lon": list(intended_lat_lon),
+                "city_name": city_name,
+                "seed": derive_seed(seed, index),
+            } for index, (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name) in enumerate(tests)],
+        }
+        campaign = cls(directory, manifest)
+        os.makedirs(campaign._path(), exist_ok=True)
+        _write_json(os.path.join(directory, MANIFEST_NAME), manifest)
+        return campaign
+
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Args:
+            directory (str): The directory of a campaign started with create.
+
+        Returns:
+            Campaign: The campaign.
+        """
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            return cls(directory, json.load(f))
+
+
+    @property
+    def seed(self):
+        return self.manifest["seed"]
+
+
+    @property
+    def percent_error(self):
+        return self.manifest["percent_error"]
+
+
+    @property
+    def chunk_size(self):
+        """The iterations per chunk of the checkpoints, or None before the first scheduled run."""
+        return self.manifest["settings"].get("chunk_size")
+
+
+    def record_chunk_size(self, chunk_size):
+        """
+        Record the chunk size of the checkpoints in the manifest, so a resumed run cuts the same chunks.
+
+        Raises:
+            ValueError: If the campaign was checkpointed with another chunk size.
+        """
+        if self.chunk_size == chunk_size:
+            return
+        if self.chunk_size is not None:
+            raise ValueError(f"The campaign was checkpointed with a chunk size of {self.chunk_size}, not {chunk_size}")
+        self.manifest["settings"]["chunk_size"] = chunk_size
+        _write_json(os.path.join(self.directory, MANIFEST_NAME), self.manifest)
+
+
+    @property
+    def tests(self):
+        """Every target, in the form of the run_test arguments."""
+        return [(pd.Timestamp(target["datetime"]), target["solar_azimuth"], target["solar_elevation"],
+                 target["intended_lat_lon"], target["city_name"]) for target in self.manifest["targets"]]
+
+
+    def target_seed(self, index):
+        return self.manifest["targets"][index]["seed"]
+
+
+    def pending(self):
+        """
+        Returns:
+            list: The indexes of the targets without a completion marker.
+        """
+        return [index for index in range(len(self.manifest["targets"])) if not self.is_done(index)]
+
+
+    def is_done(self, index):
+        return os.path.exists(self._path(index, "done"))
+
+
+    def mark_done(self, index):
+        """
+        Mark a target finished once its results are written, and drop its chunk checkpoints.
+        """
+        os.makedirs(self._path(index), exist_ok=True)
+        with open(self._path(index, "done"), "w") as f:
+            f.write(datetime.datetime.now().isoformat())
+        for name in os.listdir(self._path(index)):
+            if name.endswith(".npy"):
+                os.remove(self._path(index, name))
+
+
+    def load_chunk(self, index, change_type, offset):
+        """
+        Returns:
+            numpy.ndarray or None: The checkpointed rows of a chunk, or None if it did not finish.
+        """
+        path = self._path(index, f"{change_type}_{offset}.npy")
+        return np.load(path) if os.path.exists(path) else None
+
+
+    def save_chunk(self, index, change_type, offset, rows):
+        """
+        Checkpoint the rows of a finished chunk. The file is renamed into place, so a crash never leaves half a chunk.
+        """
+        os.makedirs(self._path(index), exist_ok=True)
+        path = self._path(index, f"{change_type}_{offset}.npy")
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, np.asarray(rows, dtype=np.float64))
+        os.replace(path + ".tmp", path)
+
+
+    def checkpoint(self, indexes):
+        """
+        Args:
+            indexes (list): The campaign indexes of the targets handed to a scheduler.
+
+        Returns:
+            ChunkCheckpoint: The checkpoints of those targets, indexed like the scheduler's observations.
+        """
+        return ChunkCheckpoint(self, indexes)
+
+
+    def _path(self, index=None, name=None):
+        parts = [self.directory, CHECKPOINT_DIRECTORY]
+        if index is not None:
+            parts.append(str(index))
+        if name is not None:
+            parts.append(name)
+        return os.path.join(*parts)
+
+
+class ChunkCheckpoint:
+    """
+    The checkpoints of some targets of a campaign, for sweep_scheduler.SweepCollector.
+    """
+
+    def __init__(self, campaign, indexes):
+        self.campaign = campaign
+        self.indexes = list(indexes)
+
+
+    @property
+    def chunk_size(self):
+        return self.campaign.chunk_size
+
+
+    def record_chunk_size(self, chunk_size):
+        self.campaign.record_chunk_size(chunk_size)
+
+
+    def load_chunk(self, target_index, change_type, offset):
+        return self.campaign.load_chunk(self.indexes[target_index], change_type, offset)
+
+
+    def save_chunk(self, target_index, change_type, offset, rows):
+        self.campaign.save_chunk(self.indexes[target_index], change_type, offset, rows)
+
+
+    def mark_done(self, target_index):
+        self.campaign.mark_done(self.indexes[target_index])
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,261 @@
+import os
+import sys
+import time
+import queue
+import traceback
+import datetime
+import multiprocessing
+from multiprocessing.managers import BaseManager
+import find_position_Error as error_sweep
+import sweep_scheduler as scheduler
+
+DEFAULT_PORT = 50051
+# Iterations per task when neither the caller nor the checkpoints set one
+DEFAULT_CHUNK_SIZE = 20
+# Workers and coordinators without an -authkey read it from here
+AUTHKEY_ENV = "SUN_SWEEP_AUTHKEY"
+
+# Only used inside the manager's server process, every other process reaches them through proxies
+_task_queue = queue.Queue()
+_result_queue = queue.Queue()
+
+
+def _get_task_queue():
+    return _task_queue
+
+
+def _get_result_queue():
+    return _result_queue
+
+
+class SweepManager(BaseManager):
+    """
+    Serves the task and result queues of a distributed sweep over TCP.
+    """
+
+
+SweepManager.register("get_task_queue", callable=_get_task_queue)
+SweepManager.register("get_result_queue", callable=_get_result_queue)
+
+
+def _authkey(authkey):
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_ENV)
+    if isinstance(authkey, str):
+        authkey = authkey.encode()
+    return authkey
+
+
+def run_worker(address, authkey=None, connect_timeout=60, poll_interval=1):
+    """
+    Pull chunk tasks from a coordinator and send back their rows until the coordinator says to stop.
+
+    A task that raises is sent back with its traceback instead of rows, so the coordinator can stop
+    the sweep rather than wait for it.
+
+    Args:
+        address (tuple): The (host, port) of the coordinator.
+        authkey (bytes or str, optional): The coordinator's key. Defaults to None, read from SUN_SWEEP_AUTHKEY.
+        connect_timeout (float, optional): Seconds to keep retrying while the coordinator starts. Defaults to 60.
+        poll_interval (float, optional): Seconds to wait for a task before asking again. Defaults to 1.
+    """
+    manager = SweepManager(address=tuple(address), authkey=_authkey(authkey))
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            manager.connect()
+            break
+        except ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(poll_interval)
+
+    tasks = manager.get_task_queue()
+    results = manager.get_result_queue()
+    while True:
+        try:
+            item = tasks.get(timeout=poll_interval)
+        except queue.Empty:
+            continue
+        except (EOFError, ConnectionError):
+            # The coordinator has gone away
+            return
+
+        if item is None:
+            # Put the stop marker back for the next worker
+            tasks.put(None)
+            return
+
+        task_id, task = item
+        try:
+            results.put((task_id, scheduler.run_chunk_task(*task), None))
+        except Exception:
+            results.put((task_id, None, traceback.format_exc()))
+
+
+def start_workers(address, authkey=None, processes=None):
+    """
+    Start worker processes on this machine.
+
+    Args:
+        address (tuple): The (host, port) of the coordinator.
+        authkey (bytes or str, optional): The coordinator's key. Defaults to None, read from SUN_SWEEP_AUTHKEY.
+        processes (int, optional): The number of workers. Defaults to None, one per CPU.
+
+    Returns:
+        list: The started multiprocessing.Process objects.
+    """
+    workers = [multiprocessing.Process(target=run_worker, args=(address, authkey), daemon=True)
+               for _ in range(processes or multiprocessing.cpu_count())]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def coordinate_error_sweeps(observations, percent_errors, address=("", DEFAULT_PORT), authkey=None, local_workers=0,
+                            modes=error_sweep.CHANGE_TYPES, engine="grid", chunk_size=None, task_timeout=600,
+                            max_requeues=3, on_complete=None, progress=scheduler.print_progress, seeds=None, checkpoint=None):
+    """
+    Serve the chunk tasks of many targets to workers on any number of machines and collect their results.
+
+    The coordinator solves the nominal locations, queues every (target, mode, chunk) task and puts each
+    target back together as its rows stream in, the same as schedule_error_sweeps. Workers connect with
+    run_worker (python distributed_sweep.py -connect host:port) over a multiprocessing.managers TCP
+    queue, so nothing but Python is needed on any machine. If no result arrives for task_timeout
+    seconds, the unfinished tasks are queued again and whichever copy finishes first is kept, so a
+    lost worker only costs time. A task that raises on a worker, or no results after max_requeues
+    rounds of queueing again, stops the sweep with a RuntimeError. local_workers starts that many workers on this machine as well, which
+    also makes a single host stand-in for testing.
+
+    Args:
+        observations (list): Tuples of (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name).
+        percent_errors (float or list): The largest error in degrees, for every target or one per target.
+        address (tuple, optional): The (host, port) to listen on, port 0 picks a free one. Defaults to all interfaces on DEFAULT_PORT.
+        authkey (bytes or str, optional): The key workers must present. Defaults to None, read from SUN_SWEEP_AUTHKEY
+                                          or, failing that, a random key that is printed for the remote workers.
+        local_workers (int, optional): Workers to start on this machine. Defaults to 0.
+        modes (tuple, optional): Which of "both", "azimuth" and "elevation" to perturb. Defaults to all three.
+        engine (str, optional): The find_location engine to solve with. Defaults to "grid".
+        chunk_size (int, optional): The iterations per task. Defaults to None, the chunk size of the checkpoints
+                                    if they have one, otherwise DEFAULT_CHUNK_SIZE.
+        task_timeout (float, optional): Seconds without any result before unfinished tasks are queued again. Defaults to 600.
+        max_requeues (int, optional): Times in a row the tasks are queued again without a result before giving up. Defaults to 3.
+        on_complete (function, optional): Called with each finished sweep dict. Defaults to None.
+        progress (function, optional): Called after every chunk, see sweep_scheduler.print_progress. Defaults to print_progress.
+        seeds (list, optional): The seed of every target, see schedule_error_sweeps. Defaults to None.
+        checkpoint (campaign.ChunkCheckpoint, optional): Skips and records chunks, see schedule_error_sweeps. Defaults to None.
+
+    Returns:
+        list: The sweep dicts in the order of observations.
+
+    Raises:
+        RuntimeError: If a task fails on a worker or no worker returns results.
+        ValueError: If chunk_size differs from the chunk size of the checkpoints.
+    """
+    chunk_size = scheduler.checkpoint_chunk_size(checkpoint, chunk_size, lambda: DEFAULT_CHUNK_SIZE)
+    authkey = _authkey(authkey)
+    if authkey is None:
+        authkey = os.urandom(16).hex().encode()
+        print(f"Workers connect with -authkey {authkey.decode()}")
+
+    manager = SweepManager(address=tuple(address), authkey=authkey)
+    manager.start()
+    workers = []
+    try:
+        print(f"Coordinator listening on {manager.address[0]}:{manager.address[1]}")
+        tasks = manager.get_task_queue()
+        results = manager.get_result_queue()
+        workers = start_workers(manager.address, authkey, local_workers) if local_workers else []
+
+        observations, percent_errors, iterations = scheduler.prepare_targets(observations, percent_errors)
+        start_time = datetime.datetime.now()
+        nominal_locations = [error_sweep.calculator.locate(datetime_value, solar_azimuth, solar_elevation, engine=engine)
+                             for datetime_value, solar_azimuth, solar_elevation, _, _ in observations]
+
+        chunk_tasks = scheduler.build_chunk_tasks(observations, iterations, nominal_locations, modes, engine, chunk_size, seeds)
+        collector = scheduler.SweepCollector(observations, percent_errors, nominal_locations, chunk_tasks, modes, start_time,
+                                             on_complete=on_complete, progress=progress, checkpoint=checkpoint, engine=engine)
+        chunk_tasks = collector.restore(chunk_tasks)
+        for task_id, task in enumerate(chunk_tasks):
+            tasks.put((task_id, task))
+
+        outstanding = set(range(len(chunk_tasks)))
+        last_result = time.monotonic()
+        requeues = 0
+        while not collector.finished:
+            try:
+                task_id, result, error = results.get(timeout=1)
+            except queue.Empty:
+                if time.monotonic() - last_result > task_timeout:
+                    if requeues >= max_requeues:
+                        raise RuntimeError(f"No results after queueing {len(outstanding)} unfinished tasks again "
+                                           f"{requeues} times, are any workers connected?")
+                    requeues += 1
+                    print(f"\nNo results for {task_timeout} s, queueing {len(outstanding)} unfinished tasks again")
+                    for task_id in sorted(outstanding):
+                        tasks.put((task_id, chunk_tasks[task_id]))
+                    last_result = time.monotonic()
+                continue
+
+            if error is not None:
+                raise RuntimeError(f"Task {task_id} ({chunk_tasks[task_id][1]}, target {chunk_tasks[task_id][0]}) "
+                                   f"failed on a worker:\n{error}")
+            # A task queued again can finish twice
+            if task_id not in outstanding:
+                continue
+            outstanding.discard(task_id)
+            last_result = time.monotonic()
+            requeues = 0
+            collector.add(*result)
+
+        # Tell every worker to stop
+        tasks.put(None)
+        for worker in workers:
+            worker.join(timeout=10)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        manager.shutdown()
+
+    return collector.sweeps
+
+
+def main(argv):
+    """
+    Worker entry point: python distributed_sweep.py -connect <host:port> [-processes <n>] [-authkey <key>]
+
+    Args:
+        argv (list): The command line arguments, including the script name.
+    """
+    address = None
+    processes = None
+    authkey = None
+
+    i = 1
+    while i < len(argv):
+        if(argv[i] == "-connect" and i < len(argv) - 1):
+            i += 1
+            host, port = argv[i].rsplit(":", 1)
+            address = (host, int(port))
+        elif(argv[i] == "-processes" and i < len(argv) - 1):
+            i += 1
+            processes = int(argv[i])
+        elif(argv[i] == "-authkey" and i < len(argv) - 1):
+            i += 1
+            authkey = argv[i]
+        else:
+            print("ERROR: Invalid usage")
+            sys.exit(1)
+        i += 1
+
+    if address is None:
+        print("Usage: python distributed_sweep.py -connect <host:port> [-processes <n>] [-authkey <key>]")
+        sys.exit(1)
+
+    for worker in start_workers(address, authkey, processes):
+        worker.join()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,21 +1,37 @@
 import pandas as pd
 import random
-from haversine import haversine, Unit
+from haversine import haversine, haversine_vector, Unit
 import datetime
 import calc_sun_local_funcs as sun
+from streaming_stats import StreamingStats
+import results_store
+import run_registry
 import multiprocessing
 import sys
-import matplotlib.pyplot as plt
-import folium
-from folium.plugins import HeatMap
-from folium.plugins import MousePosition
-from folium.plugins import HeatMap, MousePosition, MeasureControl, MarkerCluster
 import os
+import json
+import contextlib
+import importlib.util
 import numpy as np
 
 
-def add_percent_error(number, percent_error):
-    random_number = random.uniform(-percent_error, percent_error)
+CHANGE_TYPES = ("both", "azimuth", "elevation")
+# Columns of the result array returned for each mode of a sweep
+SWEEP_COLUMNS = ("latitude", "longitude", "distance", "azimuth_error", "elevation_error", "iteration")
+# Most found locations drawn on a sweep's folium map
+MAP_POINT_LIMIT = 2000
+# Sobol sampling needs scipy.stats.qmc, without it the adaptive sweep falls back to stratified sampling
+HAVE_SCIPY = importlib.util.find_spec("scipy") is not None
+# Independent randomized sequences of the adaptive sweep, and the two sided 95% t quantile for their 9 degrees of freedom
+ADAPTIVE_REPLICATES = 10
+ADAPTIVE_T_95 = 2.262
+
+# Create an instance of the functions class, shared by every iteration run in this process
+calculator = sun.functions()
+
+
+def add_percent_error(number, percent_error, rng=random):
+    random_number = rng.uniform(-percent_error, percent_error)
     # print("error", random_number)
     result = number + random_number
     # print("number", number)
@@ -23,16 +39,43 @@ def add_percent_error(number, percent_error):
     return result, random_number
 
 # Define a function to perform the task for each iteration
-def process_iteration(iteration, error_on_run, change):
+def process_iteration(iteration, change, datetime_value, initial_solar_azimuth, initial_solar_elevation,
+                      intended_lat_lon, nominal_location=None, engine="grid", seed=None, index=None):
+    """
+    Solve one perturbed measurement and measure its distance from the intended location.
+
+    Everything the iteration needs is passed in, so it also runs under the spawn start method. With a seed
+    the perturbation only depends on the seed, the mode and the index of the sample, so a sweep gives the
+    same rows however it is split into chunks or processes, or resumed. The index rather than the
+    iteration keys it, since samples of a sweep can share an iteration.
+
+    Args:
+        iteration (int): Scales the error bound, the perturbation is drawn from +-iteration / 100 degrees.
+        change (str): Which measurement to perturb, "both", "azimuth" or "elevation".
+        datetime_value (pd.Timestamp): The UTC time of the measurement.
+        initial_solar_azimuth (float): The unperturbed solar azimuth in degrees.
+        initial_solar_elevation (float): The unperturbed solar elevation in degrees.
+        intended_lat_lon (list): The latitude and longitude the measurement was taken at.
+        nominal_location (tuple, optional): The solution of the unperturbed measurement to warm start from. Defaults to None.
+        engine (str, optional): The find_location engine to solve with. Defaults to "grid".
+        seed (int, optional): The seed of the target. Defaults to None, unseeded.
+        index (int, optional): The position of the sample in its mode. Defaults to None.
+
+    Returns:
+        tuple: One result row, in the order of SWEEP_COLUMNS.
+    """
+    rng = random if seed is None else random.Random(f"{seed}:{change}:{index}")
+    azimuth_percent_error = 0
+    solar_elevation_percent_error = 0
     if iteration is not None:
         if change == 'azimuth' or change == 'both':
-            solar_azimuth, azimuth_percent_error = add_percent_error(initial_solar_azimuth, (iteration / 100))
+            solar_azimuth, azimuth_percent_error = add_percent_error(initial_solar_azimuth, (iteration / 100), rng)
         else:
             solar_azimuth = initial_solar_azimuth
             azimuth_percent_error = 0  # or any default value you prefer
 
         if change == 'elevation' or change == 'both':
-            solar_elevation, solar_elevation_percent_error = add_percent_error(initial_solar_elevation, (iteration / 100))
+            solar_elevation, solar_elevation_percent_error = add_percent_error(initial_solar_elevation, (iteration / 100), rng)
             solar_elevation = max(solar_elevation, 20)
         else:
             solar_elevation = initial_solar_elevation
@@ -43,217 +86,812 @@ def process_iteration(iteration, error_on_run, change):
 
 
 
-    closest_location = calculator.find_location(datetime_value, solar_azimuth, solar_elevation, lat_min=-90,
-                                                lat_max=90,
-                                                lon_min=-180,
-                                                lon_max=180,
-                                                step_size=10)
+    # Perturbed samples land near the nominal solution, so start there instead of a global pass
+    closest_location = calculator.locate(datetime_value, solar_azimuth, solar_elevation, engine=engine,
+                                         warm_start=nominal_location)
 
-    j = 10
-    while j >= 10 / (10 ** 10):
-        closest_location = calculator.find_location(datetime_value, solar_azimuth, solar_elevation,
-                                                    lat_min=max((closest_location[0] - j), -90),
-                                                    lat_max=min((closest_location[0] + j), 90),
-                                                    lon_min=max((closest_location[1] - j), -180),
-                                                    lon_max=min((closest_location[1] + j), 180),
-                                                    step_size=j / 10)
-        j /= 10
+    return (closest_location[0], closest_location[1], haversine(intended_lat_lon, closest_location, unit=Unit.MILES),
+            azimuth_percent_error, solar_elevation_percent_error, iteration)
 
-    error_on_run[closest_location] = [[haversine(intended_lat_lon, closest_location, unit=Unit.MILES),
-                                       azimuth_percent_error, solar_elevation_percent_error], iteration]
 
- # Create an instance of the functions class
-calculator = sun.functions()
+def process_chunk(offset, iterations, *args):
+    """
+    Run process_iteration over a chunk of iterations so a worker sends back one message per chunk.
+
+    Args:
+        offset (int): The index of the first sample of the chunk in its mode.
+        iterations (list): The iterations to run.
+        *args: The remaining process_iteration arguments.
+
+    Returns:
+        list: One result row per iteration.
+    """
+    return [process_iteration(iteration, *args, index=offset + i) for i, iteration in enumerate(iterations)]
+
+
+def _process_chunk_star(args):
+    return process_chunk(*args)
+
+
+# Shared result array of the current pool, set in each worker by _init_shared_worker
+_shared_results = None
+
+
+def _init_shared_worker(shared_array, rows):
+    global _shared_results
+    _shared_results = np.frombuffer(shared_array, dtype=np.float64).reshape(-1, rows, len(SWEEP_COLUMNS))
 
-if len(sys.argv) != 10:
-    print("Usage: python find_position_Error.py <datetime_value> <solar_azimuth> <solar_elevation> <latitude longitude> <max_runs>")
-    sys.exit(1)
-    
-datetime_value_str = sys.argv[1]
-solar_azimuth = float(sys.argv[2])
-solar_elevation = float(sys.argv[3])
-latitude = float(sys.argv[4])
-longitude = float(sys.argv[5])
-max_runs = int(sys.argv[6])
-percent_error = float(sys.argv[7])
-city_name = str(sys.argv[8])
-filename = str(sys.argv[9])
-
-try:
-    datetime_value = pd.Timestamp(datetime_value_str)
-except ValueError:
-    print("Error: Invalid datetime format. Please provide datetime in 'YYYY-MM-DD HH:MM:SS' format.")
-    sys.exit(1)
-
-intended_lat_lon = [latitude, longitude]
-start_time = datetime.datetime.now()
-
-manager = multiprocessing.Manager()
-error_on_run_master = manager.dict()
-date, time, hour, minute = start_time.date(), start_time.time(), start_time.hour, start_time.minute
-
-# Set the initial solar azimuth and elevation
-initial_solar_azimuth = solar_azimuth
-initial_solar_elevation = solar_elevation
-
-# Create a pool of processes
-pool = multiprocessing.Pool()
-
-for change_type in ["both", "azimuth", "elevation"]:
-    # Create a new dictionary for each run with a unique name
-    error_on_run = manager.dict()
-    dict_name = f"error_on_run_{change_type}"
-    locals()[dict_name] = error_on_run  # Store the dictionary with a unique name in locals()
-    
-    # Perform the iterations in parallel
-    pool.starmap(process_iteration, [(i, error_on_run, change_type) for i in range(int(percent_error * -100), int(percent_error * 100))])
-
-    
-    # Merge the data from the individual dictionary into the master dictionary
-    for key, value in error_on_run.items():
-        error_on_run_master[key] = value
-
-
-# Close the pool of processes
-pool.close()
-pool.join()
-
-# Record the end time
-end_time = datetime.datetime.now()
-
-# Calculate the runtime
-runtime = end_time - start_time
-
-hours = runtime.seconds // 3600
-minutes = (runtime.seconds % 3600) // 60
-seconds = runtime.seconds % 60
-milliseconds = runtime.microseconds // 1000
-
-directory = f"{filename}/{city_name}"
-# Create the directory if it doesn't exist
-os.makedirs(directory, exist_ok=True)
-
-for change_type in ["both", "azimuth", "elevation"]:
-    # Get the corresponding error_on_run dictionary
-    error_on_run = locals()[f"error_on_run_{change_type}"]
-    
-    # Extract values
-    values = [data[0][0] for data in error_on_run.values()]
-    
-    # Calculate statistics
-    mean_value = sum(values) / len(values)
-    sorted_values = sorted(values)
-    n = len(sorted_values)
-    if n % 2 == 0:
-        median_value = (sorted_values[n//2 - 1] + sorted_values[n//2]) / 2
+
+def process_chunk_shared(mode_index, offset, iterations, *args):
+    """
+    Run process_iteration over a chunk and write the rows straight into the pool's shared result array.
+
+    Args:
+        mode_index (int): The mode the chunk belongs to, the first axis of the shared array.
+        offset (int): The row the first iteration of this chunk is written to.
+        iterations (list): The iterations to run.
+        *args: The remaining process_iteration arguments.
+    """
+    for i, iteration in enumerate(iterations):
+        _shared_results[mode_index, offset + i] = process_iteration(iteration, *args, index=offset + i)
+
+
+def run_error_sweep(observation, percent_error, samples=None, modes=CHANGE_TYPES, engine="grid", processes=None,
+                    chunk_size=None, collect="chunks", pool=None, seed=None):
+    """
+    Run the Monte Carlo error sweep for one observation.
+
+    Args:
+        observation (tuple): (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name),
+                             the same form as the tests built by run_multiple_tests.py.
+        percent_error (float): The largest error in degrees added to the measurements.
+        samples (int, optional): The number of samples per mode. Defaults to None, which runs one sample
+                                 per hundredth of a degree from -percent_error to percent_error.
+        modes (tuple, optional): Which of "both", "azimuth" and "elevation" to perturb. Defaults to all three.
+        engine (str, optional): The find_location engine to solve with. Defaults to "grid".
+        processes (int, optional): The number of worker processes. Defaults to None, one per CPU.
+        chunk_size (int, optional): The iterations sent to a worker at once. Defaults to None, about four chunks per worker.
+        collect (str, optional): "chunks" to return each chunk's rows from the worker, or "shared" to have workers
+                                 write into a shared memory array. Defaults to "chunks".
+        pool (multiprocessing.Pool, optional): A running pool to use and leave open, so several sweeps can share
+                                               one set of warm workers. Not available with collect="shared".
+                                               Defaults to None, a new pool for this sweep.
+        seed (int, optional): Makes the sweep reproducible, see process_iteration. Defaults to None, unseeded.
+
+    Returns:
+        dict: The observation fields, "nominal_location", "engine", "start_time", "runtime" (datetime.timedelta) and
+              "results", mapping each mode to an array with one row per sample and the columns in SWEEP_COLUMNS.
+    """
+    datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name = observation
+    datetime_value = pd.Timestamp(datetime_value)
+    intended_lat_lon = list(intended_lat_lon)
+
+    if samples is None:
+        iterations = list(range(int(percent_error * -100), int(percent_error * 100)))
+    else:
+        iterations = [int(i) for i in np.linspace(percent_error * -100, percent_error * 100, samples, endpoint=False)]
+
+    if collect not in ("chunks", "shared"):
+        raise ValueError(f"Unknown collect mode: {collect}")
+    if collect == "shared" and pool is not None:
+        raise ValueError("collect=\"shared\" starts its own pool and cannot use a given one")
+
+    # Warm the solar epoch cache once so every forked worker inherits it
+    calculator.solar_epoch(datetime_value)
+    # Solution of the unperturbed measurement, used to warm start every perturbed sample
+    nominal_location = calculator.locate(datetime_value, solar_azimuth, solar_elevation, engine=engine)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(iterations) // (4 * processes)))
+    chunks = [(offset, iterations[offset:offset + chunk_size]) for offset in range(0, len(iterations), chunk_size)]
+    rows = len(iterations)
+
+    start_time = datetime.datetime.now()
+    results = {}
+
+    if collect == "shared":
+        # One block for every mode, handed to the workers when the pool starts
+        shared_array = multiprocessing.RawArray("d", max(1, len(modes) * rows * len(SWEEP_COLUMNS)))
+        shared_results = np.frombuffer(shared_array, dtype=np.float64)[:len(modes) * rows * len(SWEEP_COLUMNS)]
+        shared_results = shared_results.reshape(len(modes), rows, len(SWEEP_COLUMNS))
+        pool_context = multiprocessing.Pool(processes, initializer=_init_shared_worker, initargs=(shared_array, rows))
+    elif pool is None:
+        pool_context = multiprocessing.Pool(processes)
+    else:
+        pool_context = contextlib.nullcontext(pool)
+
+    with pool_context as pool:
+        for mode_index, change_type in enumerate(modes):
+            args = (change_type, datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, nominal_location, engine, seed)
+
+            if collect == "shared":
+                pool.starmap(process_chunk_shared, [(mode_index, offset, chunk) + args for offset, chunk in chunks])
+                results[change_type] = shared_results[mode_index].copy()
+            else:
+                # Every sample keeps its own row, so samples that land on the same point are all counted
+                sweep_rows = []
+                for chunk_rows in pool.imap_unordered(_process_chunk_star, [(offset, chunk) + args for offset, chunk in chunks]):
+                    sweep_rows.extend(chunk_rows)
+                results[change_type] = np.array(sweep_rows, dtype=np.float64).reshape(-1, len(SWEEP_COLUMNS))
+
+    return {
+        "datetime_value": datetime_value,
+        "solar_azimuth": solar_azimuth,
+        "solar_elevation": solar_elevation,
+        "intended_lat_lon": intended_lat_lon,
+        "city_name": city_name,
+        "percent_error": percent_error,
+        "nominal_location": nominal_location,
+        "engine": engine,
+        "start_time": start_time,
+        "runtime": datetime.datetime.now() - start_time,
+        "results": results,
+        "stats": {mode: StreamingStats().update(rows[:, 2]) for mode, rows in results.items()},
+    }
+
+
+def _solve_sweep_chunk(seed, start, count, samples, change_type, datetime_value, solar_azimuth, solar_elevation,
+                       intended_lat_lon, percent_error, nominal_location, engine, keep_rows):
+    """
+    Draw and solve samples start to start + count of one mode of a vectorized sweep.
+
+    Returns:
+        tuple: The result rows (None unless keep_rows) and a StreamingStats of their distances.
+    """
+    rng = np.random.default_rng(seed)
+    # Same bounds as np.linspace(-100 * percent_error, 100 * percent_error, samples, endpoint=False)[start:start + count]
+    iterations = np.trunc(percent_error * -100 + np.arange(start, start + count) * (200 * percent_error / samples))
+    bounds = iterations / 100
+
+    azimuth_errors = np.zeros(count)
+    elevation_errors = np.zeros(count)
+    if change_type == 'azimuth' or change_type == 'both':
+        azimuth_errors = rng.uniform(-1, 1, count) * bounds
+    if change_type == 'elevation' or change_type == 'both':
+        elevation_errors = rng.uniform(-1, 1, count) * bounds
+
+    locations = calculator.locate_batch(datetime_value, solar_azimuth + azimuth_errors,
+                                        np.maximum(solar_elevation + elevation_errors, 20), engine=engine,
+                                        warm_starts=nominal_location)
+    distances = haversine_vector(np.broadcast_to(intended_lat_lon, locations.shape), locations, unit=Unit.MILES)
+
+    rows = np.column_stack((locations, distances, azimuth_errors, elevation_errors, iterations)) if keep_rows else None
+    return rows, StreamingStats().update(distances)
+
+
+def run_error_sweep_vectorized(observation, percent_error, samples=100000, modes=CHANGE_TYPES, engine="analytic",
+                               processes=1, chunk_size=25000, seed=None, keep_rows=True):
+    """
+    Run the Monte Carlo error sweep for one observation with every sample drawn and solved as arrays.
+
+    The error bounds are spread evenly from -percent_error to percent_error like run_error_sweep, and each
+    perturbation is drawn uniformly within its bound. Every chunk of chunk_size samples draws from its own
+    child of the seed, so the same seed gives the same samples whatever the number of processes. The samples
+    are solved with locate_batch, warm started from the nominal solution, and only split across processes
+    by chunk. Each chunk also returns a StreamingStats of its distances, and without keep_rows that is all
+    it returns, so memory stays constant however many samples are drawn.
+
+    Args:
+        observation (tuple): (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name).
+        percent_error (float): The largest error in degrees added to the measurements.
+        samples (int, optional): The number of samples per mode. Defaults to 100000.
+        modes (tuple, optional): Which of "both", "azimuth" and "elevation" to perturb. Defaults to all three.
+        engine (str, optional): The locate_batch engine, "grid" or "analytic". Defaults to "analytic", which
+                                solves 100000 samples in well under a second and only sends the samples
+                                without an exact solution through the grid refinement.
+        processes (int, optional): The number of worker processes, 1 solves in this process. Defaults to 1.
+        chunk_size (int, optional): The samples solved per task. Defaults to 25000.
+        seed (int, optional): Seed of the random number generator. Defaults to None.
+        keep_rows (bool, optional): Return every result row, or only the "stats" when False. Defaults to True.
+
+    Returns:
+        dict: The same structure as run_error_sweep, with "results" set to None per mode when keep_rows is False.
+    """
+    datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name = observation
+    datetime_value = pd.Timestamp(datetime_value)
+    intended_lat_lon = list(intended_lat_lon)
+    seed_sequence = np.random.SeedSequence(seed)
+
+    calculator.solar_epoch(datetime_value)
+    nominal_location = calculator.locate(datetime_value, solar_azimuth, solar_elevation,
+                                         engine="analytic" if engine == "analytic" else "grid")
+
+    start_time = datetime.datetime.now()
+    results = {}
+    stats = {}
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+
+    try:
+        for change_type in modes:
+            starts = range(0, samples, chunk_size)
+            tasks = [(chunk_seed, start, min(chunk_size, samples - start), samples, change_type, datetime_value,
+                      solar_azimuth, solar_elevation, intended_lat_lon, percent_error, nominal_location, engine, keep_rows)
+                     for chunk_seed, start in zip(seed_sequence.spawn(len(starts)), starts)]
+            chunks = map(_solve_sweep_chunk_star, tasks) if pool is None else pool.imap(_solve_sweep_chunk_star, tasks)
+
+            stats[change_type] = StreamingStats()
+            chunk_rows = []
+            for rows, chunk_stats in chunks:
+                stats[change_type].merge(chunk_stats)
+                chunk_rows.append(rows)
+            results[change_type] = np.concatenate(chunk_rows) if keep_rows and chunk_rows else None
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return {
+        "datetime_value": datetime_value,
+        "solar_azimuth": solar_azimuth,
+        "solar_elevation": solar_elevation,
+        "intended_lat_lon": intended_lat_lon,
+        "city_name": city_name,
+        "percent_error": percent_error,
+        "nominal_location": nominal_location,
+        "engine": engine,
+        "start_time": start_time,
+        "runtime": datetime.datetime.now() - start_time,
+        "results": results,
+        "stats": stats,
+    }
+
+
+def _solve_sweep_chunk_star(args):
+    return _solve_sweep_chunk(*args)
+
+
+class _ErrorSampler:
+    """
+    Draws points of the unit square for one replicate of the adaptive sweep.
+
+    "sobol" extends a scrambled Sobol sequence, "stratified" places one jittered point in each
+    cell of a grid with exactly as many cells as points per draw.
+    """
+
+    def __init__(self, sampler, rng):
+        self.sampler = sampler
+        self.rng = rng
+        if sampler == "sobol":
+            from scipy.stats import qmc
+            self.sequence = qmc.Sobol(d=2, scramble=True, seed=rng)
+
+    def draw(self, count):
+        """
+        Draw the next count points of the replicate.
+
+        The stratified grid is the most square rows x columns factorization of count, so it is square
+        for powers of 4 and twice as wide as it is tall for the other powers of 2 the doubling rounds use.
+
+        Args:
+            count (int): The number of points, a power of 2 keeps the Sobol sequence balanced.
+
+        Returns:
+            numpy.ndarray: A count x 2 array of points in [0, 1).
+        """
+        if self.sampler == "sobol":
+            return self.sequence.random(count)
+
+        rows = max(1, int(np.sqrt(count)))
+        while count % rows:
+            rows -= 1
+        columns = count // rows
+        cells = np.stack(np.meshgrid(np.arange(rows), np.arange(columns), indexing="ij"), axis=-1).reshape(-1, 2)
+        return (cells + self.rng.random(cells.shape)) / (rows, columns)
+
+
+def run_error_sweep_adaptive(observation, percent_error, tolerance=0.1, modes=CHANGE_TYPES, engine="analytic",
+                             sampler=None, first_batch=256, max_samples=2 ** 18, seed=None):
+    """
+    Run the error sweep with low discrepancy samples until the mean and median distances are known to a tolerance.
+
+    The (azimuth error, elevation error) square of +-percent_error is sampled by ADAPTIVE_REPLICATES
+    independently randomized sequences. Every round doubles each sequence and solves the new points with
+    locate_batch; the spread of the replicate means and medians gives a 95% confidence interval, and the
+    sweep stops once both half widths are at or below the tolerance.
+
+    Args:
+        observation (tuple): (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name).
+        percent_error (float): The largest error in degrees added to the measurements.
+        tolerance (float, optional): The 95% confidence half width in miles to stop at. Defaults to 0.1.
+        modes (tuple, optional): Which of "both", "azimuth" and "elevation" to perturb. Defaults to all three.
+        engine (str, optional): The locate_batch engine, "grid" or "analytic". Defaults to "analytic".
+        sampler (str, optional): "sobol" or "stratified". Defaults to None, Sobol when scipy is installed.
+        first_batch (int, optional): The samples per replicate in the first round. Defaults to 256.
+        max_samples (int, optional): Stop once this many samples per mode have been solved. Defaults to 2 ** 18.
+        seed (int, optional): Seed of the random number generator. Defaults to None.
+
+    Returns:
+        dict: The same structure as run_error_sweep (the iteration column holds 100 times the perturbation of the
+              mode, the azimuth one for "both"), plus "confidence" mapping each mode to its "mean", "median",
+              their "mean_half_width" and "median_half_width" in miles and the number of "samples".
+    """
+    if sampler is None:
+        sampler = "sobol" if HAVE_SCIPY else "stratified"
+    if sampler not in ("sobol", "stratified"):
+        raise ValueError(f"Unknown sampler: {sampler}")
+
+    datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name = observation
+    datetime_value = pd.Timestamp(datetime_value)
+    intended_lat_lon = list(intended_lat_lon)
+    rng = np.random.default_rng(seed)
+
+    calculator.solar_epoch(datetime_value)
+    nominal_location = calculator.locate(datetime_value, solar_azimuth, solar_elevation,
+                                         engine="analytic" if engine == "analytic" else "grid")
+
+    start_time = datetime.datetime.now()
+    results = {}
+    confidence = {}
+
+    for change_type in modes:
+        samplers = [_ErrorSampler(sampler, np.random.default_rng(rng.integers(2 ** 63))) for _ in range(ADAPTIVE_REPLICATES)]
+        replicate_rows = [[] for _ in samplers]
+        count = first_batch
+
+        while True:
+            for replicate, replicate_sampler in enumerate(samplers):
+                errors = (2 * replicate_sampler.draw(count) - 1) * percent_error
+                azimuth_errors = errors[:, 0] if change_type in ("azimuth", "both") else np.zeros(len(errors))
+                elevation_errors = errors[:, 1] if change_type == "both" else errors[:, 0] if change_type == "elevation" else np.zeros(len(errors))
+
+                locations = calculator.locate_batch(datetime_value, solar_azimuth + azimuth_errors,
+                                                    np.maximum(solar_elevation + elevation_errors, 20), engine=engine,
+                                                    warm_starts=nominal_location)
+                distances = haversine_vector(np.broadcast_to(intended_lat_lon, locations.shape), locations, unit=Unit.MILES)
+                iterations = 100 * (elevation_errors if change_type == "elevation" else azimuth_errors)
+                replicate_rows[replicate].append(np.column_stack((locations, distances, azimuth_errors, elevation_errors, iterations)))
+
+            distances = [np.concatenate(rows)[:, 2] for rows in replicate_rows]
+            means = np.array([d.mean() for d in distances])
+            medians = np.array([np.median(d) for d in distances])
+            mean_half_width = ADAPTIVE_T_95 * means.std(ddof=1) / np.sqrt(len(means))
+            median_half_width = ADAPTIVE_T_95 * medians.std(ddof=1) / np.sqrt(len(medians))
+
+            samples = sum(len(d) for d in distances)
+            if (mean_half_width <= tolerance and median_half_width <= tolerance) or samples >= max_samples:
+                break
+            # Doubling keeps each Sobol sequence at a power of two points
+            count = len(distances[0])
+
+        results[change_type] = np.concatenate([np.concatenate(rows) for rows in replicate_rows])
+        confidence[change_type] = {
+            "mean": means.mean(),
+            "median": medians.mean(),
+            "mean_half_width": mean_half_width,
+            "median_half_width": median_half_width,
+            "samples": samples,
+        }
+
+    return {
+        "datetime_value": datetime_value,
+        "solar_azimuth": solar_azimuth,
+        "solar_elevation": solar_elevation,
+        "intended_lat_lon": intended_lat_lon,
+        "city_name": city_name,
+        "percent_error": percent_error,
+        "nominal_location": nominal_location,
+        "engine": engine,
+        "start_time": start_time,
+        "runtime": datetime.datetime.now() - start_time,
+        "results": results,
+        "stats": {mode: StreamingStats().update(rows[:, 2]) for mode, rows in results.items()},
+        "confidence": confidence,
+    }
+
+
+def sweep_sigma(percent_error):
+    """
+    The standard deviation of the measurement errors drawn by a sweep with the given percent_error.
+
+    A sweep draws each error uniformly within a bound that is itself spread evenly up to percent_error,
+    so the errors have a mean square of percent_error ** 2 / 9. Only the variance matches: the sweep's
+    errors are not normal, so predict_error_ellipse with this sigma does not reproduce a sweep's statistics.
+
+    Args:
+        percent_error (float): The largest error in degrees of the sweep.
+
+    Returns:
+        float: The equivalent standard deviation in degrees.
+    """
+    return percent_error / 3
+
+
+def predict_error_ellipse(observations, sigma_azimuth, sigma_elevation=None, quadrature_points=32):
+    """
+    Predict the position error of observations from one Jacobian each instead of a Monte Carlo sweep.
+
+    Near the solution the position error is linear in the measurement errors, so independent normal
+    azimuth and elevation errors map through the inverse of the solar position Jacobian to a normal
+    position error with a closed form error ellipse. The predicted distances are measured from the
+    intended location, so they include the offset of the unperturbed solution, and are integrated
+    over a fixed polar quadrature of the standard normal rather than sampled. They describe normal
+    errors, not the uniform errors of a sweep, and are an estimate rather than a stand-in for one.
+
+    Args:
+        observations (list): Tuples of (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name).
+        sigma_azimuth (float): The standard deviation of the azimuth error in degrees, see sweep_sigma.
+        sigma_elevation (float, optional): The standard deviation of the elevation error in degrees. Defaults to sigma_azimuth.
+        quadrature_points (int, optional): The number of directions in the polar quadrature. Defaults to 32.
+
+    Returns:
+        dict: Arrays with one entry per observation: "city_name", "location" (the unperturbed solution),
+              "semi_major" and "semi_minor" (1 sigma semi-axes in miles), "orientation" (of the major axis
+              in degrees clockwise from north, 0 to 180), "offset" (miles from the intended location to
+              the solution) and the predicted "mean" and "median" distance from the intended location in miles.
+              Observations whose Jacobian is singular get NaN.
+    """
+    if sigma_elevation is None:
+        sigma_elevation = sigma_azimuth
+
+    datetimes = pd.to_datetime([observation[0] for observation in observations])
+    solar_azimuths = np.array([observation[1] for observation in observations], dtype=float)
+    solar_elevations = np.array([observation[2] for observation in observations], dtype=float)
+    intended = np.array([observation[3] for observation in observations], dtype=float).reshape(-1, 2)
+
+    locations = calculator.locate_batch(datetimes, solar_azimuths, solar_elevations, engine="analytic")
+    jacobian = calculator.solar_position_jacobian_array(datetimes, locations[:, 0], locations[:, 1])
+
+    # Miles per degree north, and east at each solution's latitude
+    miles_per_degree = haversine((0, 0), (1, 0), unit=Unit.MILES)
+    to_miles = np.zeros((len(locations), 2, 2))
+    to_miles[:, 0, 0] = miles_per_degree
+    to_miles[:, 1, 1] = miles_per_degree * np.cos(np.radians(locations[:, 0]))
+
+    determinant = jacobian[:, 0, 0] * jacobian[:, 1, 1] - jacobian[:, 0, 1] * jacobian[:, 1, 0]
+    determinant = np.where(np.abs(determinant) > 1e-12, determinant, np.nan)
+    inverse = np.stack((np.stack((jacobian[:, 1, 1], -jacobian[:, 0, 1]), axis=-1),
+                        np.stack((-jacobian[:, 1, 0], jacobian[:, 0, 0]), axis=-1)), axis=-2) / determinant[:, None, None]
+
+    # Maps a standard normal (azimuth, elevation) draw to a (north, east) position error in miles
+    mapping = to_miles @ inverse @ np.diag([sigma_azimuth, sigma_elevation])
+    covariance = mapping @ mapping.transpose(0, 2, 1)
+
+    finite = np.isfinite(covariance).all(axis=(1, 2))
+    eigenvalues = np.full((len(locations), 2), np.nan)
+    eigenvectors = np.full((len(locations), 2, 2), np.nan)
+    if finite.any():
+        eigenvalues[finite], eigenvectors[finite] = np.linalg.eigh(covariance[finite])
+    semi_major = np.sqrt(np.maximum(eigenvalues[:, 1], 0))
+    semi_minor = np.sqrt(np.maximum(eigenvalues[:, 0], 0))
+    orientation = np.degrees(np.arctan2(eigenvectors[:, 1, 1], eigenvectors[:, 0, 1])) % 180
+
+    lon_difference = (locations[:, 1] - intended[:, 1] + 180) % 360 - 180
+    offset = np.column_stack((locations[:, 0] - intended[:, 0], lon_difference)) * np.diagonal(to_miles, axis1=1, axis2=2)
+
+    # Polar quadrature: z = r (cos theta, sin theta) with r Rayleigh distributed, r ** 2 / 2 ~ Exp(1)
+    angles = 2 * np.pi * np.arange(quadrature_points) / quadrature_points
+    directions = mapping @ np.stack((np.cos(angles), np.sin(angles)))       # (N, 2, K)
+    nodes, weights = np.polynomial.laguerre.laggauss(32)
+    radii = np.sqrt(2 * nodes)
+
+    errors = offset[:, :, None, None] + directions[:, :, :, None] * radii
+    mean = (np.hypot(errors[:, 0], errors[:, 1]) @ weights).mean(axis=1)
+
+    # P(|offset + r v| <= rho) is exact per direction, since r solves a quadratic
+    along = np.einsum("nk,nkd->nd", offset, directions)
+    length = np.maximum((directions ** 2).sum(axis=1), 1e-300)
+    offset_squared = (offset ** 2).sum(axis=1)[:, None]
+
+    def distribution(rho):
+        discriminant = along ** 2 - length * (offset_squared - rho[:, None] ** 2)
+        root = np.sqrt(np.maximum(discriminant, 0))
+        low = np.maximum((-along - root) / length, 0)
+        high = np.maximum((-along + root) / length, 0)
+        return np.where(discriminant > 0, np.exp(-low ** 2 / 2) - np.exp(-high ** 2 / 2), 0).mean(axis=1)
+
+    low = np.zeros(len(locations))
+    high = np.hypot(offset[:, 0], offset[:, 1]) + 10 * semi_major
+    for _ in range(40):
+        middle = (low + high) / 2
+        below = distribution(middle) < 0.5
+        low = np.where(below, middle, low)
+        high = np.where(below, high, middle)
+    median = np.where(finite, (low + high) / 2, np.nan)
+
+    return {
+        "city_name": [observation[4] for observation in observations],
+        "location": locations,
+        "semi_major": semi_major,
+        "semi_minor": semi_minor,
+        "orientation": orientation,
+        "offset": np.hypot(offset[:, 0], offset[:, 1]),
+        "mean": mean,
+        "median": median,
+    }
+
+
+def write_sweep_report(sweep, filename, max_runs=None):
+    """
+    Write the scatter plots, map, histogram and test_results.txt entry for a finished sweep, and its
+    summary and samples to <city_name>/<city_name>_results.npz, see results_store.py.
+
+    Args:
+        sweep (dict): The result of run_error_sweep.
+        filename (str): The test directory, e.g. Tests/<timestamp>. Plots go into <filename>/<city_name>/.
+        max_runs (int, optional): The run count reported in test_results.txt. Defaults to the number of
+                                  samples in the sweep.
+    """
+    # The plotting backends are only loaded when a report is written
+    import matplotlib.pyplot as plt
+    import folium
+    from folium.plugins import HeatMap, MousePosition, MeasureControl, MarkerCluster
+
+    city_name = sweep["city_name"]
+    intended_lat_lon = sweep["intended_lat_lon"]
+    percent_error = sweep["percent_error"]
+    datetime_value_str = str(sweep["datetime_value"])
+    start_time = sweep["start_time"]
+    runtime = sweep["runtime"]
+    date, time = start_time.date(), start_time.time()
+
+    stats = sweep.get("stats") or {mode: StreamingStats().update(rows[:, 2]) for mode, rows in sweep["results"].items()}
+    if not stats:
+        raise ValueError(f"The sweep of {city_name} has no modes to report")
+    if max_runs is None:
+        max_runs = sum(mode_stats.count for mode_stats in stats.values())
+
+    hours = runtime.seconds // 3600
+    minutes = (runtime.seconds % 3600) // 60
+    seconds = runtime.seconds % 60
+    milliseconds = runtime.microseconds // 1000
+
+    directory = f"{filename}/{city_name}"
+    # Create the directory if it doesn't exist
+    os.makedirs(directory, exist_ok=True)
+
+    # Every sample of every mode, merged for the histogram and for write_stats to pool across cities
+    city_stats = StreamingStats()
+    for change_type, mode_stats in stats.items():
+        city_stats.merge(mode_stats)
+
+        sweep_rows = sweep["results"].get(change_type)
+        if sweep_rows is None:
+            continue
+
+        # Extract x and y values
+        x_values = (sweep_rows[:, 5] / 100).tolist()
+        y_values = sweep_rows[:, 2].tolist()
+
+        # Create scatter plot
+        plt.scatter(x_values, y_values, marker='o')
+
+        # Add labels and title
+        plt.xlabel('Degree Difference (Scaled by 100)')
+        plt.ylabel('Distance (Miles)')
+        plt.title(f'{city_name} - {change_type}\nGraph of Distance in Miles Values')
+
+        # Annotate the plot with statistical values
+        textstr = '\n'.join((
+            f'Mean: {mode_stats.mean:.2f}',
+            f'Median: {mode_stats.median:.2f}',
+            f'Min: {mode_stats.minimum:.2f}',
+            f'Max: {mode_stats.maximum:.2f}',
+        ))
+        props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
+        plt.text(0.05, 0.95, textstr, transform=plt.gca().transAxes, fontsize=10,
+                 verticalalignment='top', bbox=props)
+
+        # Save the plot to a file
+        plt.savefig(directory + "/" + city_name + f"_{change_type}_scatter_plot.png")
+
+        # Optionally, close the plot to free up memory
+        plt.close()
+
+    with open(directory + "/" + city_name + "_stats.json", "w") as f:
+        json.dump(city_stats.to_dict(), f)
+
+    # The summary in test_results.txt and the store is of every sample of every mode
+    mean_value = city_stats.mean
+    median_value = city_stats.median
+    min_value = city_stats.minimum
+    max_value = city_stats.maximum
+    target = {
+        "city_name": city_name,
+        "datetime": datetime_value_str,
+        "solar_azimuth": sweep["solar_azimuth"],
+        "solar_elevation": sweep["solar_elevation"],
+        "intended_latitude": intended_lat_lon[0],
+        "intended_longitude": intended_lat_lon[1],
+        "nominal_latitude": sweep["nominal_location"][0],
+        "nominal_longitude": sweep["nominal_location"][1],
+        "engine": sweep.get("engine") or "",
+        "percent_error": percent_error,
+        "runs": max_runs,
+        "start_time": start_time.isoformat(),
+        "runtime": runtime.total_seconds(),
+        "mean": mean_value,
+        "median": median_value,
+        "minimum": min_value,
+        "maximum": max_value,
+    }
+    for change_type, mode_stats in stats.items():
+        for name in ("count", "mean", "median", "minimum", "maximum"):
+            target[f"{change_type}_{name}"] = getattr(mode_stats, name)
+    path = results_store.write_target(filename, city_name, target, sweep["results"], SWEEP_COLUMNS)
+    # Registered as soon as it is written, so the registry never has to rescan a campaign
+    run_registry.register_target(path, registry=run_registry.registry_for(filename))
+
+    kept_rows = [rows for rows in sweep["results"].values() if rows is not None]
+    all_rows = np.concatenate(kept_rows) if kept_rows else np.empty((0, len(SWEEP_COLUMNS)))
+    # The map only draws an even subsample of large sweeps, the histogram below still counts every sample
+    map_rows = all_rows[::max(1, -(-len(all_rows) // MAP_POINT_LIMIT))]
+    points = list(map(tuple, map_rows[:, :2].tolist()))
+
+    # Sweeps run without keep_rows have no locations to draw
+    if points:
+        try:
+            # Create a Folium map centered around the average of the points
+            center = [sum([p[0] for p in points]) / len(points), sum([p[1] for p in points]) / len(points)]
+
+            # Create heatmap layer
+            heat_layer = HeatMap(points)
+
+            # Create marker layer for all points, one marker per distinct location
+            marker_cluster = MarkerCluster(name='Points')
+            for point in dict.fromkeys(points):
+                folium.Marker(point).add_to(marker_cluster)
+
+            # Create the map
+            m = folium.Map(location=center, zoom_start=5)
+            MousePosition().add_to(m)
+            m.add_child(MeasureControl())
+
+            folium.Marker(intended_lat_lon,
+                          tooltip=f"Intended: {intended_lat_lon} \n@ {datetime_value_str}",
+                          icon=folium.Icon(color='blue', icon='home'),
+                          popup=f"Intended: {intended_lat_lon} \n@ {datetime_value_str}").add_to(m)
+
+            # Add heatmap layer to the map
+            heat_layer.add_to(m)
+
+            # Add marker cluster layer to the map
+            marker_cluster.add_to(m)
+
+            # Save the map to an HTML file
+            m.save(directory + "/" + city_name + "_map" + '.html')
+
+            # # Open the saved HTML file in the default web browser
+            # webbrowser.open(directory + "/" + city_name + "_map" + '.html')
+
+        except Exception as e:
+            print(f'Map unable to be generated for {city_name}: {e}')
+
+    # Write statistics to file
+    with open(filename + "/test_results.txt", "a") as f:
+        f.write(f"\nTest started at {date}:{time}\n")
+        f.write(f"Completed {max_runs} runs with with error from\n")
+        f.write(f"{-percent_error} degrees error\n")
+        f.write(f"to\n{percent_error} degrees error\n")
+        f.write(f"Took {hours}:{minutes}:{seconds}.{milliseconds}\n")
+        f.write("\nStatistics:\n")
+        f.write("Distances from Intended in Miles:\n")
+        f.write(f"Mean: {mean_value}\n")
+        f.write(f"Median: {median_value}\n")
+        f.write(f"Minimum: {min_value}\n")
+        f.write(f"Maximum: {max_value}\n")
+        # Lower case, so write_stats only scrapes the pooled values above
+        for change_type, mode_stats in stats.items():
+            f.write(f"Mode {change_type}: mean {mode_stats.mean}, median {mode_stats.median}, "
+                    f"minimum {mode_stats.minimum}, maximum {mode_stats.maximum}\n")
+        f.write("!" * 100)
+        f.write("\n\n\n")
+
+    if city_stats.count:
+        edges, bin_counts = city_stats.histogram()
+        bins = np.arange(0, edges[-1] + city_stats.bin_width / 2, city_stats.bin_width)
+        first = int(round(edges[0] / city_stats.bin_width))
+
+        plt.figure(figsize=(15, 9))
+        counts, _, patches = plt.hist(bins[first:-1], bins=bins, weights=bin_counts, edgecolor='black')
+        plt.title(f'Histogram of Distances with 50-Step Bins')
+        plt.xlabel('Distance from intended target in miles')
+        plt.ylabel('Frequency')
+        plt.xticks(bins, rotation=90, fontsize=6)
+        plt.grid(True)
+        # Add count labels to each bar
+        for count, patch in zip(counts, patches):
+            plt.text(patch.get_x() + patch.get_width() / 2, count, int(count),
+                        ha='center', va='bottom', fontsize=8)
+        plt.savefig(directory + "/" + city_name + "distro_map" + '.png')
+        # plt.show()
+        plt.close()
     else:
-        median_value = sorted_values[n//2]
-    min_value = min(values)
-    max_value = max(values)
-    
-    # Extract x and y values
-    x_values = [data[1] / 100 for data in error_on_run.values()]
-    y_values = values
-    
-    # Create scatter plot
-    plt.scatter(x_values, y_values, marker='o')
-    
-    # Add labels and title
-    plt.xlabel('Degree Difference (Scaled by 100)')
-    plt.ylabel('Distance (Miles)')
-    plt.title(f'{city_name} - {change_type}\nGraph of Distance in Miles Values')
-    
-    # Annotate the plot with statistical values
-    textstr = '\n'.join((
-        f'Mean: {mean_value:.2f}',
-        f'Median: {median_value:.2f}',
-        f'Min: {min_value:.2f}',
-        f'Max: {max_value:.2f}',
-    ))
-    props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
-    plt.text(0.05, 0.95, textstr, transform=plt.gca().transAxes, fontsize=10,
-             verticalalignment='top', bbox=props)
-    
-    # Save the plot to a file
-    plt.savefig(directory + "/" + city_name + f"_{change_type}_scatter_plot.png")
-    
-    # Optionally, close the plot to free up memory
-    plt.close()
-
-
-points = error_on_run_master.keys()
-
-try:
-    # Create a Folium map centered around the average of the points
-    center = [sum([p[0] for p in points]) / len(points), sum([p[1] for p in points]) / len(points)]
-    
-    # Create heatmap layer
-    heat_layer = HeatMap(points)
-
-    # Create marker layer for all points
-    marker_cluster = MarkerCluster(name='Points')
-    for point in points:
-        folium.Marker(point).add_to(marker_cluster)
-
-    # Create the map
-    m = folium.Map(location=center, zoom_start=5)
-    MousePosition().add_to(m)
-    m.add_child(MeasureControl())
-    
-    folium.Marker(intended_lat_lon, 
-                  tooltip=f"Intended: {intended_lat_lon} \n@ {datetime_value_str}", 
-                  icon=folium.Icon(color='blue', icon='home'), 
-                  popup=f"Intended: {intended_lat_lon} \n@ {datetime_value_str}").add_to(m)
-
-    # Add heatmap layer to the map
-    heat_layer.add_to(m)
-    
-    # Add marker cluster layer to the map
-    marker_cluster.add_to(m)
-
-    # Save the map to an HTML file
-    m.save(directory + "/" + city_name + "_map" + '.html')
-
-    # # Open the saved HTML file in the default web browser
-    # webbrowser.open(directory + "/" + city_name + "_map" + '.html')
-
-except Exception as e:
-    print(f'Map unable to be generated for {city_name}: {e}')
-
-# Write statistics to file
-with open(filename + "/test_results.txt", "a") as f:
-    f.write(f"\nTest started at {date}:{time}\n")
-    f.write(f"Completed {max_runs} runs with with error from\n")
-    f.write(f"{-percent_error} degrees error\n")
-    f.write(f"to\n{percent_error} degrees error\n")
-    f.write(f"Took {hours}:{minutes}:{seconds}.{milliseconds}\n")
-    f.write("\nStatistics:\n")
-    f.write("Distances from Intended in Miles:\n")
-    f.write(f"Mean: {mean_value}\n")
-    f.write(f"Median: {median_value}\n")
-    f.write(f"Minimum: {min_value}\n")
-    f.write(f"Maximum: {max_value}\n")
-    f.write("!" * 100)
-    f.write("\n\n\n")
-
-values = [haversine(point, intended_lat_lon, unit=Unit.MILES) for point in points]
-
-if values:
-    max_value = max(values)
-    bins = np.arange(0, max_value + 50, 50)
-    
-    plt.figure(figsize=(15, 9))
-    counts, _, patches = plt.hist(values, bins=bins, edgecolor='black')
-    plt.title(f'Histogram of Distances with 50-Step Bins')
-    plt.xlabel('Distance from intended target in miles')
-    plt.ylabel('Frequency')
-    plt.xticks(bins, rotation=90, fontsize=6)
-    plt.grid(True)
-    # Add count labels to each bar
-    for count, patch in zip(counts, patches):
-        plt.text(patch.get_x() + patch.get_width() / 2, count, int(count), 
-                    ha='center', va='bottom', fontsize=8)
-    plt.savefig(directory + "/" + city_name + "distro_map" + '.png')
-    # plt.show()
-else:
-    print(f"No distance values found in the file.")
+        print(f"No distance values found in the file.")
+
+
+def write_error_ellipse_report(prediction, filename, percent_error):
+    """
+    Append the predicted error of each observation to test_results.txt and write its summary to the
+    results store. The predictions are kept apart from the Mean and Median of sweeps (as "Predicted mean"
+    and "predicted_mean" and so on), so write_stats does not pool them with sampled results.
+
+    Args:
+        prediction (dict): The result of predict_error_ellipse.
+        filename (str): The test directory, e.g. Tests/<timestamp>.
+        percent_error (float): The largest error in degrees the prediction stands in for.
+    """
+    os.makedirs(filename, exist_ok=True)
+    start_time = datetime.datetime.now()
+
+    with open(filename + "/test_results.txt", "a") as f:
+        for i, city_name in enumerate(prediction["city_name"]):
+            f.write(f"\nTest started at {start_time.date()}:{start_time.time()}\n")
+            f.write(f"Predicted {city_name} from the Jacobian with error from\n")
+            f.write(f"{-percent_error} degrees error\n")
+            f.write(f"to\n{percent_error} degrees error\n")
+            f.write(f"Error ellipse: {prediction['semi_major'][i]} by {prediction['semi_minor'][i]} miles "
+                    f"at {prediction['orientation'][i]} degrees from north\n")
+            f.write("\nPredicted distances from Intended in Miles (normal errors):\n")
+            f.write(f"Predicted mean: {prediction['mean'][i]}\n")
+            f.write(f"Predicted median: {prediction['median'][i]}\n")
+            f.write("!" * 100)
+            f.write("\n\n\n")
+
+            path = results_store.write_target(filename, city_name, {
+                "city_name": city_name,
+                "engine": "jacobian",
+                "percent_error": percent_error,
+                "start_time": start_time.isoformat(),
+                "semi_major": prediction["semi_major"][i],
+                "semi_minor": prediction["semi_minor"][i],
+                "orientation": prediction["orientation"][i],
+                "predicted_mean": prediction["mean"][i],
+                "predicted_median": prediction["median"][i],
+            })
+            run_registry.register_target(path, registry=run_registry.registry_for(filename))
+
+
+def main(argv):
+    """
+    Command line entry point, see the usage message for the arguments.
+
+    Args:
+        argv (list): The command line arguments, including the script name.
+    """
+    if len(argv) not in (10, 11, 12, 13, 14):
+        print("Usage: python find_position_Error.py <datetime_value> <solar_azimuth> <solar_elevation> <latitude longitude> <max_runs> <percent_error> <city_name> <directory> [engine] [samples] [seed] [tolerance]")
+        sys.exit(1)
+
+    datetime_value_str = argv[1]
+    solar_azimuth = float(argv[2])
+    solar_elevation = float(argv[3])
+    latitude = float(argv[4])
+    longitude = float(argv[5])
+    max_runs = int(argv[6])
+    percent_error = float(argv[7])
+    city_name = str(argv[8])
+    filename = str(argv[9])
+    engine = str(argv[10]) if len(argv) >= 11 else "grid"
+    # "-" keeps the default samples or seed so the later arguments can still be given
+    samples = int(argv[11]) if len(argv) >= 12 and argv[11] != "-" else None
+    seed = int(argv[12]) if len(argv) >= 13 and argv[12] != "-" else None
+    tolerance = float(argv[13]) if len(argv) == 14 else None
+
+    try:
+        datetime_value = pd.Timestamp(datetime_value_str)
+    except ValueError:
+        print("Error: Invalid datetime format. Please provide datetime in 'YYYY-MM-DD HH:MM:SS' format.")
+        sys.exit(1)
+
+    observation = (datetime_value, solar_azimuth, solar_elevation, [latitude, longitude], city_name)
+    if engine == "jacobian":
+        # Predict the error from the Jacobian instead of sampling it
+        write_error_ellipse_report(predict_error_ellipse([observation], sweep_sigma(percent_error)), filename, percent_error)
+        return
+
+    if tolerance is not None:
+        # Sample until the mean and median are known to the tolerance in miles, the engine must be grid or analytic
+        sweep = run_error_sweep_adaptive(observation, percent_error, tolerance=tolerance, engine=engine, seed=seed)
+        max_runs = None
+    elif samples is None:
+        sweep = run_error_sweep(observation, percent_error, engine=engine, seed=seed)
+    else:
+        # A sample count switches to the vectorized sweep, the engine must then be grid or analytic
+        sweep = run_error_sweep_vectorized(observation, percent_error, samples=samples, engine=engine, seed=seed)
+    write_sweep_report(sweep, filename, max_runs=max_runs)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,410 @@
+import sys
+import json
+import time
+import asyncio
+import concurrent.futures
+import numpy as np
+from calc_sun_local_funcs import functions, parse_observation, solve_observations
+from streaming_stats import StreamingStats
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# Largest request body accepted, in bytes
+MAX_BODY = 1 << 20
+# Measurement solved once at startup so the first request does not pay for the lazy imports
+WARM_UP_OBSERVATION = {"time": "2024-05-13 17:00:00", "az": 135.69, "el": 55.22, "lat": 46.817, "lon": -100.783}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+
+class LocalizationServer:
+    """
+    An asyncio HTTP server that solves measurements with calc_sun_local_funcs on request.
+
+    One calculator lives for the whole server and the imports a request needs are loaded once at start,
+    so a request only pays for its own solve. Measurements of concurrent requests that arrive within window seconds of
+    each other are solved together with one solve_observations call on a single solver thread, and
+    requests that arrive while a batch is being solved wait for the next one. If a batch fails, its
+    measurements are solved one at a time so only the ones that fail get an error.
+
+    Endpoints:
+        POST /locate: One measurement in the form of solve_jsonl, or a list of them, answered with the
+                      result (or list of results) of solve_observations.
+        GET /stats: The counters, see stats.
+        GET /health: {"status": "ok"}.
+    """
+
+    def __init__(self, engine="grid", window=0.005, max_batch=256, calculator=None):
+        """
+        Args:
+            engine (str, optional): "grid" or "analytic", see locate_batch. Defaults to "grid".
+            window (float, optional): The seconds a batch waits for more measurements after its first. Defaults to 0.005.
+            max_batch (int, optional): The most measurements solved together. Defaults to 256.
+            calculator (functions, optional): The calculator to solve with. Defaults to None, a new one.
+        """
+        if engine not in ("grid", "analytic"):
+            raise ValueError(f"Unknown engine: {engine}")
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self.calculator = calculator if calculator is not None else functions()
+        # The calculator and its caches are only touched by this one thread
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.batcher = None
+
+        self.started = time.monotonic()
+        self.requests = 0
+        self.measurements = 0
+        self.errors = 0
+        self.batches = 0
+        self.max_batch_size = 0
+        self.solve_seconds = 0.0
+        self.latency = StreamingStats(bin_width=1, relative_accuracy=0.01)
+
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Warm up the solver and start listening.
+
+        Args:
+            host (str, optional): The address to listen on. Defaults to 127.0.0.1.
+            port (int, optional): The port to listen on, 0 for any free one. Defaults to 8080.
+
+        Returns:
+            asyncio.Server: The listening server.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.warm_up)
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self._batch_loop())
+        self.started = time.monotonic()
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+
+    def warm_up(self):
+        """
+        Solve one measurement with every step of a request, so haversine and the rest of the lazy imports are loaded.
+        """
+        solve_observations([parse_observation(WARM_UP_OBSERVATION, self.calculator)], self.calculator, self.engine)
+
+
+    async def locate(self, record):
+        """
+        Solve one measurement in the next batch.
+
+        Args:
+            record (dict): A measurement in the form of solve_jsonl.
+
+        Returns:
+            dict: The result, see solve_observations.
+
+        Raises:
+            ValueError, KeyError or TypeError: If the record is not a valid measurement.
+        """
+        observation = parse_observation(record, self.calculator)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((observation, future))
+        return await future
+
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                if self.queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self.queue.get_nowait())
+
+            solve_start = time.perf_counter()
+            outcomes = await loop.run_in_executor(self.executor, self._solve_batch, [observation for observation, _ in batch])
+            self.solve_seconds += time.perf_counter() - solve_start
+            self.batches += 1
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            for (_, future), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+
+    def _solve_batch(self, observations):
+        # Runs on the solver thread and returns (result, exception) for every observation. Copies are
+        # solved, so a batch that fails part way leaves the observations as they were for the retries
+        try:
+            results = solve_observations([dict(observation) for observation in observations], self.calculator, self.engine)
+            return [(result, None) for result in results]
+        except Exception as e:
+            if len(observations) == 1:
+                return [(None, e)]
+        return [outcome for observation in observations for outcome in self._solve_batch([observation])]
+
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    break
+                if not request_line.strip():
+                    break
+                received = time.perf_counter()
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "malformed request line"}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" and (version != "HTTP/1.0" or connection == "keep-alive")
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "Content-Length must be a non-negative integer"}, False)
+                    break
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": f"bodies are limited to {MAX_BODY} bytes"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                route = path.split("?", 1)[0]
+                status, response = await self._route(method, route, body)
+                # Only solved requests count, errors and other paths would skew the solve latency
+                if route == "/locate" and status == 200:
+                    self.latency.update((time.perf_counter() - received) * 1000)
+                await self._respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def _route(self, method, path, body):
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/stats":
+            return 200, self.stats()
+        if path != "/locate":
+            return 404, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST with a JSON measurement"}
+
+        self.requests += 1
+        try:
+            records = json.loads(body)
+            many = isinstance(records, list)
+            results = await asyncio.gather(*(self.locate(record) for record in (records if many else [records])))
+        except (ValueError, KeyError, TypeError) as e:
+            self.errors += 1
+            return 400, {"error": str(e)}
+        except Exception as e:
+            self.errors += 1
+            return 500, {"error": str(e)}
+        self.measurements += len(results)
+        return 200, results if many else results[0]
+
+
+    async def _respond(self, writer, status, response, keep_alive):
+        body = json.dumps(response).encode()
+        writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                      "Content-Type: application/json\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body)
+        await writer.drain()
+
+
+    def stats(self):
+        """
+        Returns:
+            dict: The engine, uptime, request, measurement, error and batch counts, the mean and largest
+                  batch, the seconds spent solving, the requests and measurements per second of uptime
+                  and the mean, 50th, 95th, 99th percentile and largest latency of successful /locate requests in milliseconds.
+        """
+        uptime = time.monotonic() - self.started
+        latency = self.latency
+        return {
+            "engine": self.engine,
+            "uptime": uptime,
+            "requests": self.requests,
+            "measurements": self.measurements,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": self.measurements / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "solve_seconds": self.solve_seconds,
+            "requests_per_second": self.requests / uptime if uptime else 0.0,
+            "measurements_per_second": self.measurements / uptime if uptime else 0.0,
+            "latency_ms": {
+                "mean": latency.mean if latency.count else None,
+                "p50": latency.percentile(50) if latency.count else None,
+                "p95": latency.percentile(95) if latency.count else None,
+                "p99": latency.percentile(99) if latency.count else None,
+                "max": latency.maximum if latency.count else None,
+            },
+        }
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **options):
+    """
+    Run a LocalizationServer until it is interrupted.
+
+    Args:
+        host (str, optional): The address to listen on. Defaults to 127.0.0.1.
+        port (int, optional): The port to listen on. Defaults to 8080.
+        **options: The settings of LocalizationServer.
+    """
+    server = LocalizationServer(**options)
+    listener = await server.start(host, port)
+    print(f"Serving {server.engine} localization on http://{host}:{port}/locate")
+    async with listener:
+        await listener.serve_forever()
+
+
+async def _post(reader, writer, host, path, body):
+    writer.write((f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def benchmark(records, host=DEFAULT_HOST, port=DEFAULT_PORT, requests=1000, concurrency=32):
+    """
+    Load test a running server with one measurement per request over keep-alive connections.
+
+    Args:
+        records (list): The measurements to send, cycled through.
+        host (str, optional): The server address. Defaults to 127.0.0.1.
+        port (int, optional): The server port. Defaults to 8080.
+        requests (int, optional): The total requests. Defaults to 1000.
+        concurrency (int, optional): The connections sending requests at once. Defaults to 32.
+
+    Returns:
+        dict: The requests, failures, seconds, requests per second and the client side latency
+              percentiles in milliseconds.
+    """
+    bodies = [json.dumps(record).encode() for record in records]
+    latencies = []
+    failures = 0
+
+    async def client(index):
+        nonlocal failures
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for number in range(index, requests, concurrency):
+                start = time.perf_counter()
+                status, _ = await _post(reader, writer, host, "/locate", bodies[number % len(bodies)])
+                latencies.append((time.perf_counter() - start) * 1000)
+                failures += status != 200
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(min(concurrency, requests))))
+    seconds = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "failures": failures,
+        "seconds": seconds,
+        "requests_per_second": requests / seconds,
+        "latency_ms": dict(zip(("p50", "p95", "p99"), np.percentile(latencies, [50, 95, 99]).tolist())),
+    }
+
+
+def main(argv):
+    """
+    Command line entry point: python localization_server.py [-host <host>] [-port <port>] [-engine <engine>]
+    [-window <ms>] [-batch <n>], or with -bench <requests> [-concurrency <n>] [-jsonl <file>] to load test a running server.
+
+    Args:
+        argv (list): The command line arguments, including the script name.
+    """
+    host = DEFAULT_HOST
+    port = DEFAULT_PORT
+    engine = "grid"
+    window = 5
+    max_batch = 256
+    bench_requests = None
+    concurrency = 32
+    jsonl_source = None
+
+    i = 1
+    while i < len(argv):
+        if(argv[i] == "-host" and i < len(argv) - 1):
+            i += 1
+            host = argv[i]
+        elif(argv[i] == "-port" and i < len(argv) - 1):
+            i += 1
+            port = int(argv[i])
+        elif(argv[i] == "-engine" and i < len(argv) - 1):
+            i += 1
+            engine = argv[i]
+        elif(argv[i] == "-window" and i < len(argv) - 1):
+            i += 1
+            window = float(argv[i])
+        elif(argv[i] == "-batch" and i < len(argv) - 1):
+            i += 1
+            max_batch = int(argv[i])
+        elif(argv[i] == "-bench" and i < len(argv) - 1):
+            i += 1
+            bench_requests = int(argv[i])
+        elif(argv[i] == "-concurrency" and i < len(argv) - 1):
+            i += 1
+            concurrency = int(argv[i])
+        elif(argv[i] == "-jsonl" and i < len(argv) - 1):
+            i += 1
+            jsonl_source = argv[i]
+        else:
+            print("ERROR: Invalid usage")
+            sys.exit(1)
+        i += 1
+
+    if bench_requests is None:
+        try:
+            asyncio.run(serve(host, port, engine=engine, window=window / 1000, max_batch=max_batch))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    records = [WARM_UP_OBSERVATION]
+    if jsonl_source is not None:
+        with open(jsonl_source) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    print(json.dumps(asyncio.run(benchmark(records, host, port, bench_requests, concurrency)), indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,6 +1,6 @@
 import random
 
-def return_random_city():
+def return_random_city(rng=random):
     world_cities = [
     ("Tokyo", (35.6895, 139.6917)),
     ("Grand Forks", (47.9253, -97.0329)),
@@ -974,7 +974,7 @@ def return_random_city():
     ("San Marcos", (33.1434, -117.1661))]
 
     # Randomly select a location
-    selected_location = random.choice(world_cities)
+    selected_location = rng.choice(world_cities)
 
     # Extract latitude and longitude
     location_name, coords = selected_location
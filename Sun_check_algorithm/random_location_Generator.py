@@ -3,13 +3,16 @@ from datetime import date, datetime
 import datetime
 import random
 import pandas as pd
-import ephem
-import pytz
-from timezonefinder import TimezoneFinder
 from random_city_return import return_random_city
 
-def random_locations(runs):
+def random_locations(runs, seed=None, year=None):
     tests = []
+    # One generator for every draw, so a seed and the same year reproduce the same targets
+    rng = random.Random(seed)
+    # Targets fall in the ten years before the reference year, the current one by default
+    if year is None:
+        year = datetime.datetime.now().year
+    reference_year = year
 
     def calc_declenation_angle(dElapsedJulianDays, day_of_year):
         """
@@ -109,19 +112,19 @@ def random_locations(runs):
         # dt = noon + random_offset
 
         # Set the range for the year
-        year = random.randint(datetime.datetime.now().year - 10, datetime.datetime.now().year)
+        year = rng.randint(reference_year - 10, reference_year)
         
         # Set the month, day, hour, minute, and second randomly
-        month = random.randint(1, 12)
-        day = random.randint(1, 28)  # Assume February has maximum of 28 days for simplicity
-        hour = random.randint(0, 23)
-        minute = random.randint(0, 59)
-        second = random.randint(0, 59)
+        month = rng.randint(1, 12)
+        day = rng.randint(1, 28)  # Assume February has maximum of 28 days for simplicity
+        hour = rng.randint(0, 23)
+        minute = rng.randint(0, 59)
+        second = rng.randint(0, 59)
     
         # Create and return the datetime object
         dt = datetime.datetime(year, month, day, hour, minute, second)
 
-        city_name, latitude, longitude = return_random_city()
+        city_name, latitude, longitude = return_random_city(rng)
 
         # Format the datetime
         formatted_dt = dt.strftime('%Y-%m-%d %H:%M:%S %Z%z')
@@ -0,0 +1,130 @@
+import os
+import glob
+import numpy as np
+
+# File of each target, <directory>/<city_name>/<city_name>_results.npz
+RESULTS_SUFFIX = "_results.npz"
+
+
+def write_target(directory, city_name, target, results=None, columns=None):
+    """
+    Write the summary row and the samples of one target as a compressed .npz file.
+
+    Each target has its own file, so targets finishing in any order or in a resumed run never touch
+    each other's results. The file is renamed into place once it is complete.
+
+    Args:
+        directory (str): The test directory, e.g. Tests/<timestamp>.
+        city_name (str): The name of the target, which names its directory and file.
+        target (dict): The summary fields of the target, numbers or strings.
+        results (dict, optional): The sample rows of each mode. Defaults to None, a summary only.
+        columns (tuple, optional): The names of the sample columns. Defaults to None.
+
+    Returns:
+        str: The path of the file.
+    """
+    os.makedirs(f"{directory}/{city_name}", exist_ok=True)
+    path = f"{directory}/{city_name}/{city_name}{RESULTS_SUFFIX}"
+    arrays = {f"target_{name}": np.asarray(value) for name, value in target.items()}
+    for mode, rows in (results or {}).items():
+        if rows is not None:
+            arrays[f"samples_{mode}"] = np.asarray(rows, dtype=np.float64)
+    if columns is not None:
+        arrays["columns"] = np.asarray(columns)
+
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_target(path):
+    """
+    Args:
+        path (str): A file written by write_target.
+
+    Returns:
+        tuple: The summary fields as a dict, the sample rows of each mode as a dict and the column names.
+    """
+    with np.load(path) as data:
+        target = _read_target(data)
+        results = {name[len("samples_"):]: data[name] for name in data.files if name.startswith("samples_")}
+        columns = tuple(data["columns"].tolist()) if "columns" in data.files else ()
+    return target, results, columns
+
+
+def _read_target(data):
+    # Only the small summary arrays are decompressed
+    return {name[len("target_"):]: data[name].item() for name in data.files if name.startswith("target_")}
+
+
+def target_paths(directory):
+    """
+    Returns:
+        list: The result files of every target in a test directory, in the order they were started.
+    """
+    paths = glob.glob(f"{directory}/*/*{RESULTS_SUFFIX}")
+    starts = {}
+    for path in paths:
+        with np.load(path) as data:
+            starts[path] = str(_read_target(data).get("start_time", ""))
+    return sorted(paths, key=lambda path: (starts[path], path))
+
+
+def load_targets(directory):
+    """
+    Load the summary of every target of a test directory as columns.
+
+    Args:
+        directory (str): The test directory, e.g. Tests/<timestamp>.
+
+    Returns:
+        dict: One array per field with one entry per target. Numeric fields a target does not have are NaN.
+    """
+    targets = []
+    for path in target_paths(directory):
+        with np.load(path) as data:
+            targets.append(_read_target(data))
+    fields = list(dict.fromkeys(name for target in targets for name in target))
+    columns = {}
+    for name in fields:
+        values = [target.get(name) for target in targets]
+        if any(isinstance(value, str) for value in values):
+            columns[name] = np.array(["" if value is None else value for value in values])
+        else:
+            columns[name] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return columns
+
+
+def load_samples(directory, mode):
+    """
+    Load the samples of one mode of every target of a test directory.
+
+    Args:
+        directory (str): The test directory, e.g. Tests/<timestamp>.
+        mode (str): "both", "azimuth" or "elevation".
+
+    Returns:
+        tuple: The rows of every target stacked, with the index of the target in load_targets as the last
+               column, and the column names.
+    """
+    rows, columns = [], ()
+    for index, path in enumerate(target_paths(directory)):
+        with np.load(path) as data:
+            if f"samples_{mode}" not in data.files:
+                continue
+            mode_rows = data[f"samples_{mode}"]
+            columns = tuple(data["columns"].tolist())
+        rows.append(np.column_stack((mode_rows, np.full(len(mode_rows), index))))
+    columns = columns + ("target",)
+    return (np.concatenate(rows) if rows else np.empty((0, len(columns)))), columns
+
+
+def targets_frame(directory):
+    """
+    Returns:
+        pandas.DataFrame: load_targets as a table, e.g. for .to_parquet where pyarrow is installed.
+    """
+    import pandas as pd
+
+    return pd.DataFrame(load_targets(directory))
@@ -5,13 +5,12 @@ import datetime
 import time
 import os
 from random_location_Generator import random_locations
-from write_stats import write_stats
 import math
+import multiprocessing
+from campaign import Campaign, new_seed, locations_seed
 
+# Replaced by the resumed campaign's time stamp with -resume
 timestamp = time.strftime('%Y_%m_%d__%H_%M_%S', time.localtime())
-directory = f"Tests/{timestamp}"
-# Create the directory if it doesn't exist
-os.makedirs(directory, exist_ok=True)
 
 def calculate_solar_elevation_from_shadow(height_of_object, length_of_shadow):
         """
@@ -89,9 +88,12 @@ def read_test_txt(testing_filename):
                 name = str(line.split("Name: ")[1].strip())
                 names.append(name)
     
+    # Only shadow measurements set the error range, gimbal files use the default one
+    elevations_range = None
     if len(elevations) == 0:
         for height, length in zip(heights, lengths):
             elevations.append(calculate_solar_elevation_from_shadow(height, length))
+        if elevations:
             elevations_range = max(elevations) - min(elevations)
 
     try:
@@ -107,7 +109,93 @@ def read_test_txt(testing_filename):
 
     return tests, elevations_range
 
-def run_test(datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name, elevations_range = None):
+def write_test_header(filename, city_name, intended_lat_lon, solar_azimuth, solar_elevation):
+    """
+    Start the test_results.txt block of one target.
+
+    Args:
+        filename (str): The test directory, e.g. Tests/<timestamp>.
+        city_name (str): The name of the city of the target.
+        intended_lat_lon (list): A list containing the latitude and longitude of the target.
+        solar_azimuth (float): The solar azimuth of the target.
+        solar_elevation (float): The solar elevation of the target.
+    """
+    with open(filename + "/test_results.txt", "a") as f:
+        f.write("!" * 100)
+        f.write(f"\nIntended Target: {city_name};\nCoords: {intended_lat_lon};\naz/el: [{solar_azimuth}, {solar_elevation}]\n")
+
+
+def prune_test_results(filename, finished_tests):
+    """
+    Keep only the test_results.txt blocks of finished targets before a campaign is resumed.
+
+    A target that was cut off can leave part of its block behind, and a finished run has the summary of
+    write_stats appended, both of which the resumed run writes again.
+
+    Args:
+        filename (str): The test directory, e.g. Tests/<timestamp>.
+        finished_tests (list): The finished tests, tuples of the run_test arguments.
+    """
+    path = filename + "/test_results.txt"
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        blocks = f.read().split("!" * 100)
+
+    headers = [f"\nIntended Target: {city_name};\nCoords: {list(intended_lat_lon)};\n"
+               for _, _, _, intended_lat_lon, city_name in finished_tests]
+    kept = []
+    # The last block of a target is the complete one
+    for block in reversed(blocks):
+        block = block.split("\n\nMean Means value:")[0]
+        header = next((header for header in headers if block.startswith(header)), None)
+        if header is not None:
+            headers.remove(header)
+            kept.append(block)
+
+    with open(path, "w") as f:
+        for block in reversed(kept):
+            f.write("!" * 100)
+            f.write(block)
+
+
+def run_scheduled_tests(tests, elevations_range=None, workers=None, serve_port=None, authkey=None, seeds=None, checkpoint=None):
+    """
+    Run every test through one queue of (target, mode, chunk) tasks, see sweep_scheduler.py.
+
+    Each target's results are written as soon as its last chunk finishes, while the workers carry on.
+    With serve_port the queue is served to workers on other machines instead, see distributed_sweep.py.
+
+    Args:
+        tests (list): The tests, tuples of the run_test arguments.
+        elevations_range (float, optional): The error range of shadow tests. Defaults to None, 3 degrees.
+        workers (int, optional): The number of worker processes, or with serve_port the number of workers
+                                 started on this machine. Defaults to None, one per CPU (none with serve_port).
+        serve_port (int, optional): The port to coordinate remote workers on. Defaults to None, run locally.
+        authkey (str, optional): The key remote workers must present. Defaults to None, see distributed_sweep.py.
+        seeds (list, optional): The seed of every test. Defaults to None, unseeded.
+        checkpoint (campaign.ChunkCheckpoint, optional): Where finished chunks and targets are recorded. Defaults to None.
+    """
+    import find_position_Error
+    from sweep_scheduler import schedule_error_sweeps
+    from distributed_sweep import coordinate_error_sweeps
+
+    percent_error = elevations_range if elevations_range is not None else 3
+    filename = f"Tests/{timestamp}"
+
+    def write_results(sweep):
+        write_test_header(filename, sweep["city_name"], sweep["intended_lat_lon"], sweep["solar_azimuth"], sweep["solar_elevation"])
+        find_position_Error.write_sweep_report(sweep, filename, max_runs=int(percent_error * 2 * 100))
+
+    if serve_port is not None:
+        coordinate_error_sweeps(tests, percent_error, address=("", serve_port), authkey=authkey,
+                                local_workers=workers or 0, on_complete=write_results, seeds=seeds, checkpoint=checkpoint)
+    else:
+        schedule_error_sweeps(tests, percent_error, workers=workers, on_complete=write_results, seeds=seeds, checkpoint=checkpoint)
+
+
+def run_test(datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name, elevations_range = None, pool = None, seed = None,
+             tolerance = None):
     """
     Run a test for the given target and coordinates.
 
@@ -117,22 +205,33 @@ def run_test(datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, c
         solar_elevation (float): The solar elevation of the target.
         intended_lat_lon (list): A list containing the latitude and longitude of the target.
         city_name (str): The name of the city of the target.
-        elevations_range (float, optional): The range of elevations for the target. Defaults to None.
+        elevations_range (float, optional): The range of elevations for the target, used as the error range
+                                            of shadow tests. Defaults to None, an error range of 3 degrees.
+        pool (multiprocessing.Pool, optional): A warm pool to run the sweep on in this process. Defaults to None,
+                                               which launches find_position_Error.py as a subprocess.
+        seed (int, optional): The seed of the target's sweep. Defaults to None, unseeded.
+        tolerance (float, optional): Run the adaptive sweep (find_position_Error.run_error_sweep_adaptive with the
+                                     analytic engine) until the mean and median distances are known to this many
+                                     miles. Defaults to None, the fixed sweep.
     """
-    i = 1
-    while i < len(sys.argv):
-        if(sys.argv[i] == "-fileName" and i < len(sys.argv) - 1):
-            i += 1
-            percent_error = elevations_range
-        else:
-            percent_error = 3
-        i += 1
+    percent_error = elevations_range if elevations_range is not None else 3
 
     filename = f"Tests/{timestamp}"
 
-    with open(filename + "/test_results.txt", "a") as f:
-        f.write("!" * 100)
-        f.write(f"\nIntended Target: {city_name};\nCoords: {intended_lat_lon};\naz/el: [{solar_azimuth}, {solar_elevation}]\n")
+    write_test_header(filename, city_name, intended_lat_lon, solar_azimuth, solar_elevation)
+
+    if pool is not None:
+        # Imported here so the subprocess mode keeps its original startup
+        import find_position_Error
+
+        observation = (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name)
+        if tolerance is not None:
+            sweep = find_position_Error.run_error_sweep_adaptive(observation, percent_error, tolerance=tolerance, seed=seed)
+            find_position_Error.write_sweep_report(sweep, filename)
+            return
+        sweep = find_position_Error.run_error_sweep(observation, percent_error, pool=pool, seed=seed)
+        find_position_Error.write_sweep_report(sweep, filename, max_runs=int(percent_error * 2 * 100))
+        return
 
     args = [
         sys.executable,
@@ -147,6 +246,12 @@ def run_test(datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, c
         str(city_name),
         str(filename)
     ]
+    if tolerance is not None:
+        # The adaptive sweep solves its samples together, the analytic engine keeps that fast
+        args += ["analytic", "-", "-" if seed is None else str(seed), str(tolerance)]
+    elif seed is not None:
+        # Default engine and samples, then the seed
+        args += ["grid", "-", str(seed)]
     
     try:
         # Run the test and capture the output
@@ -160,8 +265,19 @@ def main():
     """
     The main function of the script.
     """
+    global timestamp
     runs = None
     testing_filename = None
+    elevations_range = None
+    in_process = False
+    schedule = False
+    serve_port = None
+    authkey = None
+    workers = None
+    seed = None
+    resume = None
+    tolerance = None
+    year = None
 
     i = 1
     while i < len(sys.argv):
@@ -171,21 +287,85 @@ def main():
         elif(sys.argv[i] == "-fileName" and i < len(sys.argv) - 1):
             i += 1
             testing_filename = str(sys.argv[i])
+        elif(sys.argv[i] == "-inProcess"):
+            in_process = True
+        elif(sys.argv[i] == "-schedule"):
+            schedule = True
+        elif(sys.argv[i] == "-serve" and i < len(sys.argv) - 1):
+            i += 1
+            serve_port = int(sys.argv[i])
+        elif(sys.argv[i] == "-authkey" and i < len(sys.argv) - 1):
+            i += 1
+            authkey = str(sys.argv[i])
+        elif(sys.argv[i] == "-workers" and i < len(sys.argv) - 1):
+            i += 1
+            workers = int(sys.argv[i])
+        elif(sys.argv[i] == "-seed" and i < len(sys.argv) - 1):
+            i += 1
+            seed = int(sys.argv[i])
+        elif(sys.argv[i] == "-tolerance" and i < len(sys.argv) - 1):
+            i += 1
+            tolerance = float(sys.argv[i])
+        elif(sys.argv[i] == "-year" and i < len(sys.argv) - 1):
+            i += 1
+            year = int(sys.argv[i])
+        elif(sys.argv[i] == "-resume" and i < len(sys.argv) - 1):
+            i += 1
+            resume = os.path.basename(os.path.normpath(sys.argv[i]))
         else:
             print("ERROR: Invalid usage")
             sys.exit(1)
         i += 1
 
-    if runs is not None and testing_filename is None:
-        # If the -locations flag is provided, generate random locations
-        tests = random_locations(runs)
-    elif runs is None and testing_filename is not None:
+    if tolerance is not None and (schedule or serve_port is not None):
+        # The scheduled runners split fixed sweeps into chunks, the adaptive sweep decides its own sample count
+        print("ERROR: -tolerance cannot be used with -schedule or -serve")
+        sys.exit(1)
+
+    if year is not None and runs is None:
+        # Only the random locations are drawn relative to a year
+        print("ERROR: -year can only be used with -locations")
+        sys.exit(1)
+
+    if resume is not None and runs is None and testing_filename is None and seed is None:
+        # Carry on in the campaign's own directory with the targets and seeds in its manifest
+        timestamp = resume
+        campaign = Campaign.load(f"Tests/{timestamp}")
+        elevations_range = campaign.percent_error
+        if tolerance is None:
+            tolerance = campaign.manifest["settings"].get("tolerance")
+    elif resume is None and runs is not None and testing_filename is None:
+        # If the -locations flag is provided, generate random locations from the campaign seed and reference year,
+        # so -seed and -year reproduce them
+        if seed is None:
+            seed = new_seed()
+        if year is None:
+            year = datetime.datetime.now().year
+        tests = random_locations(runs, seed=locations_seed(seed), year=year)
+    elif resume is None and runs is None and testing_filename is not None:
         # If the -fileName flag is provided, read the tests from the file
         tests, elevations_range = read_test_txt(testing_filename)
     else:
         print("ERROR: Invalid usage")
         sys.exit(1)
 
+    if resume is None:
+        os.makedirs(f"Tests/{timestamp}", exist_ok=True)
+        percent_error = elevations_range if elevations_range is not None else 3
+        settings = {"arguments": sys.argv[1:], "tolerance": tolerance, "reference_year": year}
+        campaign = Campaign.create(f"Tests/{timestamp}", tests, percent_error, seed=seed, settings=settings)
+        print(f"Campaign Tests/{timestamp} with seed {campaign.seed}" + (f" and reference year {year}" if year is not None else "")
+              + f", continue it with -resume {timestamp}")
+
+    # Finished targets are skipped, so a resumed campaign only runs what is left
+    pending = campaign.pending()
+    all_tests = campaign.tests
+    tests = [all_tests[index] for index in pending]
+    seeds = [campaign.target_seed(index) for index in pending]
+    if resume is not None:
+        print(f"Resuming Tests/{timestamp}: {len(all_tests) - len(pending)} of {len(all_tests)} targets finished")
+        prune_test_results(f"Tests/{timestamp}", [test for index, test in enumerate(all_tests) if index not in pending])
+
 
     # # tests = [
     # #     (pd.Timestamp('2024-05-13 17:00:00'), 135.69, 55.22, [46.817, -100.783], "Bismark, ND"),  # Bismark, ND
@@ -199,9 +379,20 @@ def main():
 
     # Record the start time
     start_time = datetime.datetime.now()
-    for test in tests:
-        # Run the test and capture the output
-        run_test(*test, elevations_range=elevations_range)
+    if schedule or serve_port is not None:
+        run_scheduled_tests(tests, elevations_range=elevations_range, workers=workers, serve_port=serve_port, authkey=authkey,
+                            seeds=seeds, checkpoint=campaign.checkpoint(pending))
+    elif in_process:
+        # One pool stays warm for every target instead of a new interpreter and pool per target
+        with multiprocessing.Pool(workers) as pool:
+            for index, test, test_seed in zip(pending, tests, seeds):
+                run_test(*test, elevations_range=elevations_range, pool=pool, seed=test_seed, tolerance=tolerance)
+                campaign.mark_done(index)
+    else:
+        for index, test, test_seed in zip(pending, tests, seeds):
+            # Run the test and capture the output
+            run_test(*test, elevations_range=elevations_range, seed=test_seed, tolerance=tolerance)
+            campaign.mark_done(index)
 
     # Record the end time
     end_time = datetime.datetime.now()
@@ -209,7 +400,8 @@ def main():
     # Calculate the runtime
     runtime = end_time - start_time
 
-    # Write the stats to a file
+    # Write the stats to a file, the plotting backends are only loaded here
+    from write_stats import write_stats
     write_stats(timestamp, str(runtime))
         
 
@@ -0,0 +1,295 @@
+import os
+import sys
+import glob
+import json
+import sqlite3
+import numpy as np
+import results_store
+
+# Registry shared by every campaign in Tests/
+DEFAULT_REGISTRY = "Tests/registry.sqlite"
+# Seconds a writer waits for another process holding the registry
+LOCK_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign TEXT PRIMARY KEY,
+    seed TEXT,
+    created TEXT,
+    arguments TEXT
+);
+CREATE TABLE IF NOT EXISTS targets (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    modified REAL,
+    campaign TEXT,
+    city_name TEXT,
+    datetime TEXT,
+    intended_latitude REAL,
+    intended_longitude REAL,
+    solar_azimuth REAL,
+    solar_elevation REAL,
+    percent_error REAL,
+    engine TEXT,
+    runs REAL,
+    runtime REAL,
+    mean REAL,
+    median REAL,
+    minimum REAL,
+    maximum REAL,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    target_id INTEGER REFERENCES targets(id) ON DELETE CASCADE,
+    mode TEXT,
+    latitude REAL,
+    longitude REAL,
+    distance REAL,
+    azimuth_error REAL,
+    elevation_error REAL,
+    iteration REAL
+);
+CREATE INDEX IF NOT EXISTS targets_city ON targets(city_name);
+CREATE INDEX IF NOT EXISTS targets_datetime ON targets(datetime);
+CREATE INDEX IF NOT EXISTS targets_error ON targets(percent_error);
+CREATE INDEX IF NOT EXISTS targets_engine ON targets(engine);
+CREATE INDEX IF NOT EXISTS targets_campaign ON targets(campaign);
+CREATE INDEX IF NOT EXISTS samples_target ON samples(target_id, mode);
+"""
+
+# Summary fields with a column of their own, the rest are kept in the summary JSON
+TARGET_COLUMNS = ("city_name", "datetime", "intended_latitude", "intended_longitude", "solar_azimuth", "solar_elevation",
+                  "percent_error", "engine", "runs", "runtime", "mean", "median", "minimum", "maximum")
+# Sample columns stored in the registry, looked up by name in each results file
+SAMPLE_COLUMNS = ("latitude", "longitude", "distance", "azimuth_error", "elevation_error", "iteration")
+# Filters of the query helpers, keyword to SQL condition
+FILTERS = {
+    "campaign": "t.campaign = ?",
+    "city_name": "t.city_name = ?",
+    "engine": "t.engine = ?",
+    "percent_error": "t.percent_error = ?",
+    "since": "t.datetime >= ?",
+    "until": "t.datetime < ?",
+}
+
+
+def registry_for(directory):
+    """
+    Returns:
+        str: The registry next to a Tests/<time_stamp> directory, Tests/registry.sqlite.
+    """
+    return os.path.join(os.path.dirname(os.path.normpath(directory)), "registry.sqlite")
+
+
+def connect(registry=DEFAULT_REGISTRY):
+    """
+    Open the registry, creating it if needed.
+
+    Args:
+        registry (str, optional): The SQLite file. Defaults to Tests/registry.sqlite.
+
+    Returns:
+        sqlite3.Connection: The connection.
+    """
+    os.makedirs(os.path.dirname(registry) or ".", exist_ok=True)
+    connection = sqlite3.connect(registry, timeout=LOCK_TIMEOUT)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def register_target(path, registry=DEFAULT_REGISTRY, connection=None):
+    """
+    Add one <city_name>_results.npz file and its samples to the registry.
+
+    A file already registered with the same modification time is skipped, and one that changed
+    (e.g. a target that was run again) replaces its old rows.
+
+    Args:
+        path (str): A file written by results_store.write_target, inside Tests/<time_stamp>/<city_name>/.
+        registry (str, optional): The SQLite file. Defaults to Tests/registry.sqlite.
+        connection (sqlite3.Connection, optional): An open registry to use instead. Defaults to None.
+
+    Returns:
+        bool: Whether the file was added.
+    """
+    own_connection = connection is None
+    if own_connection:
+        connection = connect(registry)
+    try:
+        path = os.path.abspath(path)
+        modified = os.path.getmtime(path)
+        known = connection.execute("SELECT modified FROM targets WHERE path = ?", (path,)).fetchone()
+        if known is not None and known[0] == modified:
+            return False
+
+        target, results, columns = results_store.load_target(path)
+        campaign_directory = os.path.dirname(os.path.dirname(path))
+        campaign = os.path.basename(campaign_directory)
+        with connection:
+            connection.execute("DELETE FROM targets WHERE path = ?", (path,))
+            _register_campaign(connection, campaign_directory)
+            cursor = connection.execute(
+                f"INSERT INTO targets (path, modified, campaign, {', '.join(TARGET_COLUMNS)}, summary) "
+                f"VALUES ({', '.join('?' * (len(TARGET_COLUMNS) + 4))})",
+                (path, modified, campaign, *[target.get(name) for name in TARGET_COLUMNS], json.dumps(target)))
+            for mode, rows in results.items():
+                indexes = [columns.index(name) for name in SAMPLE_COLUMNS]
+                connection.executemany(
+                    f"INSERT INTO samples VALUES ({', '.join('?' * (len(SAMPLE_COLUMNS) + 2))})",
+                    ((cursor.lastrowid, mode, *row) for row in rows[:, indexes].tolist()))
+        return True
+    finally:
+        if own_connection:
+            connection.close()
+
+
+def _register_campaign(connection, campaign_directory):
+    manifest_path = os.path.join(campaign_directory, "campaign.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    connection.execute("INSERT OR IGNORE INTO campaigns VALUES (?, ?, ?, ?)",
+                       (os.path.basename(campaign_directory), str(manifest.get("seed", "")), manifest.get("created"),
+                        json.dumps(manifest.get("settings", {}).get("arguments", []))))
+
+
+def ingest(directory="Tests", registry=DEFAULT_REGISTRY):
+    """
+    Register every results file under a campaign or the whole Tests directory that is new or changed.
+
+    Only the modification times of registered files are checked, so old campaigns are not read again.
+
+    Args:
+        directory (str, optional): A Tests/<time_stamp> campaign or the Tests directory. Defaults to "Tests".
+        registry (str, optional): The SQLite file. Defaults to Tests/registry.sqlite.
+
+    Returns:
+        int: The number of files added.
+    """
+    paths = glob.glob(f"{directory}/*/*{results_store.RESULTS_SUFFIX}") + \
+            glob.glob(f"{directory}/*/*/*{results_store.RESULTS_SUFFIX}")
+    connection = connect(registry)
+    try:
+        return sum(register_target(path, connection=connection) for path in sorted(paths))
+    finally:
+        connection.close()
+
+
+def _where(filters):
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+    conditions = [FILTERS[name] for name, value in filters.items() if value is not None]
+    values = [value for value in filters.values() if value is not None]
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", values
+
+
+def query_targets(registry=DEFAULT_REGISTRY, **filters):
+    """
+    Args:
+        registry (str, optional): The SQLite file. Defaults to Tests/registry.sqlite.
+        **filters: Any of campaign, city_name, engine, percent_error, since and until (datetimes as
+                   "YYYY-MM-DD HH:MM:SS" strings).
+
+    Returns:
+        list: One dict per matching target, with its columns and the full summary.
+    """
+    where, values = _where(filters)
+    connection = connect(registry)
+    try:
+        connection.row_factory = sqlite3.Row
+        rows = connection.execute(f"SELECT * FROM targets t{where} ORDER BY t.datetime", values).fetchall()
+    finally:
+        connection.close()
+    targets = []
+    for row in rows:
+        target = dict(row)
+        target["summary"] = json.loads(target["summary"])
+        targets.append(target)
+    return targets
+
+
+def query_samples(registry=DEFAULT_REGISTRY, mode=None, **filters):
+    """
+    Args:
+        registry (str, optional): The SQLite file. Defaults to Tests/registry.sqlite.
+        mode (str, optional): Only samples of "both", "azimuth" or "elevation". Defaults to None, every mode.
+        **filters: Filters on the targets, see query_targets.
+
+    Returns:
+        numpy.ndarray: The intended latitude and longitude of the target and the distance of every matching sample.
+    """
+    where, values = _where(filters)
+    if mode is not None:
+        where += (" AND " if where else " WHERE ") + "s.mode = ?"
+        values.append(mode)
+    connection = connect(registry)
+    try:
+        rows = connection.execute("SELECT t.intended_latitude, t.intended_longitude, s.distance "
+                                  f"FROM samples s JOIN targets t ON s.target_id = t.id{where}", values).fetchall()
+    finally:
+        connection.close()
+    return np.array(rows, dtype=np.float64).reshape(-1, 3)
+
+
+def percentile_by_latitude_band(percentile=95, band_width=10, registry=DEFAULT_REGISTRY, mode=None, **filters):
+    """
+    The given percentile of the sample distances of every run, grouped by the latitude of the target.
+
+    Args:
+        percentile (float, optional): The percentile between 0 and 100. Defaults to 95.
+        band_width (float, optional): The width of the latitude bands in degrees. Defaults to 10.
+        registry (str, optional): The SQLite file. Defaults to Tests/registry.sqlite.
+        mode (str, optional): Only samples of one mode. Defaults to None, every mode.
+        **filters: Filters on the targets, see query_targets.
+
+    Returns:
+        list: Tuples of (band start latitude, sample count, percentile distance in miles), from south to north.
+    """
+    samples = query_samples(registry, mode=mode, **filters)
+    bands = np.floor(samples[:, 0] / band_width) * band_width
+    return [(float(band), int((bands == band).sum()), float(np.percentile(samples[bands == band, 2], percentile)))
+            for band in np.unique(bands)]
+
+
+def main(argv):
+    """
+    Command line entry point: python run_registry.py [-ingest <directory>] [-bands <percentile>] [-registry <file>]
+
+    Args:
+        argv (list): The command line arguments, including the script name.
+    """
+    registry = DEFAULT_REGISTRY
+    directory = None
+    percentile = None
+    band_width = 10
+
+    i = 1
+    while i < len(argv):
+        if(argv[i] == "-ingest" and i < len(argv) - 1):
+            i += 1
+            directory = argv[i]
+        elif(argv[i] == "-bands" and i < len(argv) - 1):
+            i += 1
+            percentile = float(argv[i])
+        elif(argv[i] == "-registry" and i < len(argv) - 1):
+            i += 1
+            registry = argv[i]
+        else:
+            print("ERROR: Invalid usage")
+            sys.exit(1)
+        i += 1
+
+    if directory is None and percentile is None:
+        directory = "Tests"
+    if directory is not None:
+        print(f"Registered {ingest(directory, registry)} new or changed targets from {directory}")
+    if percentile is not None:
+        for band, count, value in percentile_by_latitude_band(percentile, band_width, registry=registry):
+            print(f"Latitude {band:.0f} to {band + band_width:.0f}: {percentile:g}th percentile {value:.2f} miles of {count} samples")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
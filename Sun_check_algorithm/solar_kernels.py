@@ -0,0 +1,120 @@
+import math
+import importlib.util
+import numpy as np
+
+# Numba is optional, it is only imported (and the kernel compiled) the first time it is needed
+HAVE_NUMBA = importlib.util.find_spec("numba") is not None
+
+_numba_grid_argmin = None
+
+
+def _load_numba_grid_argmin():
+    """
+    Compile the fused Numba grid kernel on first use.
+
+    Returns:
+        function: The compiled kernel.
+    """
+    global _numba_grid_argmin
+    if _numba_grid_argmin is not None:
+        return _numba_grid_argmin
+
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def grid_argmin(declination_angle, EoT, minute_of_day, latitudes, longitudes, solar_azimuth, solar_elevation):
+        sin_declination = math.sin(declination_angle)
+        cos_declination = math.cos(declination_angle)
+        row_residuals = np.empty(latitudes.shape[0])
+        row_indices = np.empty(latitudes.shape[0], dtype=np.int64)
+
+        # Every latitude row is independent, so rows are spread over all cores
+        for i in numba.prange(latitudes.shape[0]):
+            latitude = math.radians(latitudes[i])
+            sin_latitude = math.sin(latitude)
+            cos_latitude = math.cos(latitude)
+            best_residual = np.inf
+            best_index = 0
+            for j in range(longitudes.shape[0]):
+                hour_angle = math.radians(15 * ((minute_of_day + 4 * longitudes[j] + EoT) / 60 - 12))
+                cos_hour_angle = math.cos(hour_angle)
+                sin_altitude = min(max(sin_latitude * sin_declination + cos_latitude * cos_declination * cos_hour_angle, -1.0), 1.0)
+                altitude = math.degrees(math.asin(sin_altitude))
+                azimuth = math.degrees(math.atan2(-cos_declination * math.sin(hour_angle),
+                                                  cos_latitude * sin_declination - sin_latitude * cos_declination * cos_hour_angle))
+                residual = abs((azimuth - solar_azimuth + 180) % 360 - 180) + abs(altitude - solar_elevation)
+                if residual < best_residual:
+                    best_residual = residual
+                    best_index = j
+            row_residuals[i] = best_residual
+            row_indices[i] = best_index
+
+        best_row = 0
+        for i in range(1, latitudes.shape[0]):
+            if row_residuals[i] < row_residuals[best_row]:
+                best_row = i
+        return best_row, row_indices[best_row], row_residuals[best_row]
+
+    _numba_grid_argmin = grid_argmin
+    return _numba_grid_argmin
+
+
+def _numpy_grid_argmin(declination_angle, EoT, minute_of_day, latitudes, longitudes, solar_azimuth, solar_elevation):
+    """
+    Pure NumPy version of the grid kernel, used when Numba is not installed.
+    """
+    hour_angle = np.radians(15 * ((minute_of_day + 4 * longitudes[None, :] + EoT) / 60 - 12))
+    latitude = np.radians(latitudes[:, None])
+    sin_declination = math.sin(declination_angle)
+    cos_declination = math.cos(declination_angle)
+    cos_hour_angle = np.cos(hour_angle)
+
+    altitude = np.degrees(np.arcsin(np.clip(np.sin(latitude) * sin_declination +
+                                            np.cos(latitude) * cos_declination * cos_hour_angle, -1.0, 1.0)))
+    azimuth = np.degrees(np.arctan2(-cos_declination * np.sin(hour_angle),
+                                    np.cos(latitude) * sin_declination - np.sin(latitude) * cos_declination * cos_hour_angle))
+    residuals = np.abs((azimuth - solar_azimuth + 180) % 360 - 180) + np.abs(altitude - solar_elevation)
+
+    best = residuals.argmin()
+    lat_index, lon_index = np.unravel_index(best, residuals.shape)
+    return lat_index, lon_index, residuals[lat_index, lon_index]
+
+
+def grid_argmin(declination_angle, EoT, minute_of_day, latitudes, longitudes, solar_azimuth, solar_elevation, backend="auto"):
+    """
+    Find the grid cell whose solar position best matches a measurement.
+
+    The solar position, the residual (absolute azimuth difference wrapped to +-180 plus absolute
+    elevation difference) and the argmin are fused into one loop, so no intermediate arrays are
+    allocated. With Numba the latitude rows run in parallel on all cores (NUMBA_NUM_THREADS
+    limits them); without it the same calculation runs as NumPy array operations.
+
+    Args:
+        declination_angle (float): The solar declination angle in radians.
+        EoT (float): The equation of time in minutes.
+        minute_of_day (float): The minutes elapsed since midnight UTC.
+        latitudes (numpy.ndarray): The latitudes of the grid rows in degrees.
+        longitudes (numpy.ndarray): The longitudes of the grid columns in degrees.
+        solar_azimuth (float): The measured solar azimuth angle in degrees.
+        solar_elevation (float): The measured solar elevation angle in degrees.
+        backend (str, optional): "numba", "numpy", or "auto" to use Numba when it is installed. Defaults to "auto".
+
+    Returns:
+        tuple: The row index, the column index and the residual of the best cell.
+    """
+    latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+    longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+
+    if backend == "auto":
+        backend = "numba" if HAVE_NUMBA else "numpy"
+
+    if backend == "numba":
+        kernel = _load_numba_grid_argmin()
+    elif backend == "numpy":
+        kernel = _numpy_grid_argmin
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+
+    lat_index, lon_index, residual = kernel(float(declination_angle), float(EoT), float(minute_of_day), latitudes, longitudes,
+                                            float(solar_azimuth), float(solar_elevation))
+    return int(lat_index), int(lon_index), float(residual)
@@ -0,0 +1,212 @@
+import math
+import numpy as np
+
+
+class StreamingStats:
+    """
+    Constant memory summary of a stream of distances.
+
+    Keeps the count, mean and variance (Welford's update, combined per batch with Chan's formula),
+    the minimum and maximum, a fixed width histogram, and a log bucketed sketch for quantiles whose
+    answers are within relative_accuracy of the true value. Every part adds up exactly, so summaries
+    built in different processes or for different cities can be merged.
+    """
+
+    def __init__(self, bin_width=50, relative_accuracy=0.005):
+        """
+        Args:
+            bin_width (float, optional): The width of the histogram bins. Defaults to 50 (miles).
+            relative_accuracy (float, optional): The relative error allowed in quantiles. Defaults to 0.005.
+        """
+        self.bin_width = bin_width
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.zero_count = 0
+        self.positive_buckets = {}
+        self.negative_buckets = {}
+        self.histogram_bins = {}
+
+
+    def update(self, values):
+        """
+        Add one value or an array of values. Non finite values are ignored.
+
+        Args:
+            values (float or array-like): The values to add.
+
+        Returns:
+            StreamingStats: self, so calls can be chained.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return self
+
+        batch_mean = values.mean()
+        self._combine(len(values), batch_mean, ((values - batch_mean) ** 2).sum())
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+
+        self.zero_count += int((values == 0).sum())
+        for buckets, magnitudes in ((self.positive_buckets, values[values > 0]), (self.negative_buckets, -values[values < 0])):
+            _add_counts(buckets, np.ceil(np.log(magnitudes) / math.log(self.gamma)))
+        _add_counts(self.histogram_bins, np.floor(values / self.bin_width))
+        return self
+
+
+    def merge(self, other):
+        """
+        Add every value summarized by another StreamingStats with the same settings.
+
+        Args:
+            other (StreamingStats): The summary to merge in.
+
+        Returns:
+            StreamingStats: self, so calls can be chained.
+        """
+        if other.bin_width != self.bin_width or other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only StreamingStats with the same bin_width and relative_accuracy can be merged")
+        if not other.count:
+            return self
+
+        self._combine(other.count, other.mean, other.m2)
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.zero_count += other.zero_count
+        for buckets, other_buckets in ((self.positive_buckets, other.positive_buckets),
+                                       (self.negative_buckets, other.negative_buckets),
+                                       (self.histogram_bins, other.histogram_bins)):
+            for key, count in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + count
+        return self
+
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+
+    @property
+    def variance(self):
+        """The sample variance, NaN for fewer than two values."""
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+
+    @property
+    def std(self):
+        """The sample standard deviation."""
+        return math.sqrt(self.variance)
+
+
+    @property
+    def median(self):
+        """The median, within relative_accuracy."""
+        return self.quantile(0.5)
+
+
+    def quantile(self, q):
+        """
+        Estimate a quantile from the log bucketed sketch.
+
+        Args:
+            q (float): The quantile between 0 and 1.
+
+        Returns:
+            float: The estimate, within relative_accuracy of the value of that rank, or NaN when empty.
+        """
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+
+        # Walk the buckets from the most negative value up to the largest one
+        seen = 0
+        for sign, buckets in ((-1, self.negative_buckets), (0, None), (1, self.positive_buckets)):
+            if sign == 0:
+                seen += self.zero_count
+                if seen > rank:
+                    return min(max(0.0, self.minimum), self.maximum)
+                continue
+            for key in sorted(buckets, reverse=sign < 0):
+                seen += buckets[key]
+                if seen > rank:
+                    value = sign * 2 * self.gamma ** key / (self.gamma + 1)
+                    return min(max(value, self.minimum), self.maximum)
+        return self.maximum
+
+
+    def percentile(self, p):
+        """
+        Args:
+            p (float): The percentile between 0 and 100.
+
+        Returns:
+            float: The estimate, see quantile.
+        """
+        return self.quantile(p / 100)
+
+
+    def histogram(self):
+        """
+        Returns:
+            tuple: The bin edges and the counts of every bin from the lowest to the highest filled one.
+        """
+        if not self.histogram_bins:
+            return np.array([0.0, self.bin_width]), np.zeros(1, dtype=int)
+        first, last = min(self.histogram_bins), max(self.histogram_bins)
+        counts = np.array([self.histogram_bins.get(key, 0) for key in range(first, last + 1)])
+        return np.arange(first, last + 2) * self.bin_width, counts
+
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: A JSON serializable copy of the summary, see from_dict.
+        """
+        return {
+            "bin_width": self.bin_width,
+            "relative_accuracy": self.relative_accuracy,
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "minimum": self.minimum if self.count else None,
+            "maximum": self.maximum if self.count else None,
+            "zero_count": self.zero_count,
+            "positive_buckets": self.positive_buckets,
+            "negative_buckets": self.negative_buckets,
+            "histogram_bins": self.histogram_bins,
+        }
+
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Args:
+            data (dict): A summary written by to_dict, possibly after a JSON round trip.
+
+        Returns:
+            StreamingStats: The summary.
+        """
+        stats = cls(bin_width=data["bin_width"], relative_accuracy=data["relative_accuracy"])
+        stats.count = data["count"]
+        stats.mean = data["mean"]
+        stats.m2 = data["m2"]
+        stats.minimum = math.inf if data["minimum"] is None else data["minimum"]
+        stats.maximum = -math.inf if data["maximum"] is None else data["maximum"]
+        stats.zero_count = data["zero_count"]
+        for name in ("positive_buckets", "negative_buckets", "histogram_bins"):
+            setattr(stats, name, {int(key): count for key, count in data[name].items()})
+        return stats
+
+
+def _add_counts(buckets, keys):
+    keys, counts = np.unique(keys.astype(np.int64), return_counts=True)
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        buckets[key] = buckets.get(key, 0) + count
@@ -0,0 +1,287 @@
+import datetime
+import multiprocessing
+import contextlib
+import numpy as np
+import pandas as pd
+import find_position_Error as error_sweep
+from streaming_stats import StreamingStats
+
+
+def _solve_nominal(index, observation, engine):
+    datetime_value, solar_azimuth, solar_elevation = observation[:3]
+    return index, error_sweep.calculator.locate(pd.Timestamp(datetime_value), solar_azimuth, solar_elevation, engine=engine)
+
+
+def _solve_nominal_star(args):
+    return _solve_nominal(*args)
+
+
+def run_chunk_task(target_index, change_type, offset, iterations, args):
+    return target_index, change_type, offset, error_sweep.process_chunk(offset, iterations, change_type, *args)
+
+
+def _run_chunk_star(args):
+    return run_chunk_task(*args)
+
+
+def print_progress(done_chunks, total_chunks, done_targets, total_targets, elapsed):
+    """
+    Default progress report of schedule_error_sweeps, one line per completed chunk.
+
+    Args:
+        done_chunks (int): The chunks finished so far.
+        total_chunks (int): The chunks of every target.
+        done_targets (int): The targets whose every chunk has finished.
+        total_targets (int): The number of targets.
+        elapsed (datetime.timedelta): The time since the scheduler started.
+    """
+    seconds = elapsed.total_seconds()
+    remaining = seconds / done_chunks * (total_chunks - done_chunks) if done_chunks else float("nan")
+    print(f"\rChunks {done_chunks}/{total_chunks}, targets {done_targets}/{total_targets}, "
+          f"{seconds:.1f} s elapsed, about {remaining:.1f} s left", end="\n" if done_chunks == total_chunks else "", flush=True)
+
+
+def prepare_targets(observations, percent_errors):
+    """
+    Normalize the targets of a multi-target sweep.
+
+    Args:
+        observations (list): Tuples of (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name).
+        percent_errors (float or list): The largest error in degrees, for every target or one per target.
+
+    Returns:
+        tuple: The observations with pd.Timestamp times, the percent errors as a list and the iterations of every target.
+    """
+    if np.ndim(percent_errors) == 0:
+        percent_errors = [percent_errors] * len(observations)
+    observations = [(pd.Timestamp(observation[0]), observation[1], observation[2], list(observation[3]), observation[4])
+                    for observation in observations]
+    iterations = [list(range(int(percent_error * -100), int(percent_error * 100))) for percent_error in percent_errors]
+    return observations, list(percent_errors), iterations
+
+
+def build_chunk_tasks(observations, iterations, nominal_locations, modes, engine, chunk_size, seeds=None):
+    """
+    Split every mode of every target into chunk tasks, the largest targets first so the last tasks are short ones.
+    seeds holds the seed of every target, see find_position_Error.process_iteration.
+
+    Returns:
+        list: Tuples of (target_index, change_type, offset, iterations, process_iteration arguments).
+    """
+    order = sorted(range(len(observations)), key=lambda index: -len(iterations[index]))
+    tasks = []
+    for target_index in order:
+        datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, _ = observations[target_index]
+        for change_type in modes:
+            seed = None if seeds is None else seeds[target_index]
+            args = (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, nominal_locations[target_index], engine, seed)
+            for offset in range(0, len(iterations[target_index]), chunk_size):
+                tasks.append((target_index, change_type, offset, iterations[target_index][offset:offset + chunk_size], args))
+    return tasks
+
+
+def checkpoint_chunk_size(checkpoint, chunk_size, default):
+    """
+    Settle the chunk size of a run, so the chunks of a resumed run line up with its checkpoints.
+
+    Args:
+        checkpoint (campaign.ChunkCheckpoint or None): The checkpoints of the run.
+        chunk_size (int or None): The chunk size asked for.
+        default (function): Returns the chunk size to use when neither is set.
+
+    Returns:
+        int: The chunk size the checkpoints were written with, otherwise chunk_size or the default,
+             which is then recorded with the checkpoints.
+
+    Raises:
+        ValueError: If chunk_size differs from the chunk size of the checkpoints.
+    """
+    recorded = None if checkpoint is None else checkpoint.chunk_size
+    if recorded is not None:
+        if chunk_size is not None and chunk_size != recorded:
+            raise ValueError(f"The checkpoints were written with a chunk size of {recorded}, not {chunk_size}")
+        return recorded
+    if chunk_size is None:
+        chunk_size = default()
+    if checkpoint is not None:
+        checkpoint.record_chunk_size(chunk_size)
+    return chunk_size
+
+
+class SweepCollector:
+    """
+    Puts chunk results back together per target as they arrive, in any order.
+    """
+
+    def __init__(self, observations, percent_errors, nominal_locations, tasks, modes, start_time, on_complete=None, progress=None,
+                 checkpoint=None, engine=None):
+        """
+        Args:
+            observations (list): The targets, as returned by prepare_targets.
+            percent_errors (list): The largest error in degrees of every target.
+            nominal_locations (list): The unperturbed solution of every target.
+            tasks (list): Every task from build_chunk_tasks.
+            modes (tuple): The modes of the sweep.
+            start_time (datetime.datetime): When the run started.
+            on_complete (function, optional): Called with each finished sweep dict. Defaults to None.
+            progress (function, optional): Called after every chunk, see print_progress. Defaults to None.
+            checkpoint (campaign.ChunkCheckpoint, optional): Saves every chunk as it arrives and marks each target
+                                                             done once on_complete returns. Defaults to None.
+            engine (str, optional): The engine the tasks solve with, recorded in each sweep. Defaults to None.
+        """
+        self.observations = observations
+        self.percent_errors = percent_errors
+        self.nominal_locations = nominal_locations
+        self.start_time = start_time
+        self.on_complete = on_complete
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.engine = engine
+        self.total_chunks = len(tasks)
+        self.done_chunks = 0
+        self.done_targets = 0
+        self.remaining = [0] * len(observations)
+        for task in tasks:
+            self.remaining[task[0]] += 1
+        self.pieces = [{change_type: [] for change_type in modes} for _ in observations]
+        self.sweeps = [None] * len(observations)
+
+        # Targets without any iterations finish straight away
+        for target_index in range(len(observations)):
+            if not self.remaining[target_index]:
+                self._finish(target_index)
+
+
+    @property
+    def finished(self):
+        return self.done_targets == len(self.observations)
+
+
+    def restore(self, tasks):
+        """
+        Add the chunks already in the checkpoint.
+
+        Args:
+            tasks (list): The tasks from build_chunk_tasks.
+
+        Returns:
+            list: The tasks that still have to run.
+        """
+        if self.checkpoint is None:
+            return tasks
+        pending = []
+        for task in tasks:
+            target_index, change_type, offset = task[:3]
+            chunk_rows = self.checkpoint.load_chunk(target_index, change_type, offset)
+            if chunk_rows is None:
+                pending.append(task)
+            else:
+                self.add(target_index, change_type, offset, chunk_rows.tolist(), restored=True)
+        return pending
+
+
+    def add(self, target_index, change_type, offset, chunk_rows, restored=False):
+        """
+        Store the rows of one finished chunk, and finish its target if it was the last one.
+        """
+        if self.checkpoint is not None and not restored:
+            self.checkpoint.save_chunk(target_index, change_type, offset, chunk_rows)
+        self.pieces[target_index][change_type].append((offset, chunk_rows))
+        self.remaining[target_index] -= 1
+        self.done_chunks += 1
+        if not self.remaining[target_index]:
+            self._finish(target_index)
+        if self.progress is not None:
+            self.progress(self.done_chunks, self.total_chunks, self.done_targets, len(self.observations),
+                          datetime.datetime.now() - self.start_time)
+
+
+    def _finish(self, target_index):
+        datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name = self.observations[target_index]
+        results = {}
+        for change_type, mode_pieces in self.pieces[target_index].items():
+            rows = [row for _, chunk_rows in sorted(mode_pieces, key=lambda piece: piece[0]) for row in chunk_rows]
+            results[change_type] = np.array(rows, dtype=np.float64).reshape(-1, len(error_sweep.SWEEP_COLUMNS))
+        self.sweeps[target_index] = {
+            "datetime_value": datetime_value,
+            "solar_azimuth": solar_azimuth,
+            "solar_elevation": solar_elevation,
+            "intended_lat_lon": intended_lat_lon,
+            "city_name": city_name,
+            "percent_error": self.percent_errors[target_index],
+            "nominal_location": self.nominal_locations[target_index],
+            "engine": self.engine,
+            # Targets share the workers, so the runtime is from the run start until the target finished
+            "start_time": self.start_time,
+            "runtime": datetime.datetime.now() - self.start_time,
+            "results": results,
+            "stats": {mode: StreamingStats().update(rows[:, 2]) for mode, rows in results.items()},
+        }
+        self.pieces[target_index] = None
+        self.done_targets += 1
+        if self.on_complete is not None:
+            self.on_complete(self.sweeps[target_index])
+        if self.checkpoint is not None:
+            self.checkpoint.mark_done(target_index)
+
+
+def schedule_error_sweeps(observations, percent_errors, modes=error_sweep.CHANGE_TYPES, engine="grid", workers=None,
+                          chunk_size=None, pool=None, on_complete=None, progress=print_progress, seeds=None, checkpoint=None):
+    """
+    Run the error sweeps of many targets as one queue of (target, mode, chunk) tasks.
+
+    run_error_sweep only runs the samples of one target in parallel, so cores idle between targets and
+    while plots are written. Here the nominal solutions of every target are solved in parallel first,
+    then every chunk of every mode of every target goes into one queue that idle workers pull from, the
+    largest targets first. Results are put back together per target as they arrive, and each finished
+    target is handed to on_complete while the workers carry on with the rest.
+
+    Args:
+        observations (list): Tuples of (datetime_value, solar_azimuth, solar_elevation, intended_lat_lon, city_name).
+        percent_errors (float or list): The largest error in degrees, for every target or one per target.
+        modes (tuple, optional): Which of "both", "azimuth" and "elevation" to perturb. Defaults to all three.
+        engine (str, optional): The find_location engine to solve with. Defaults to "grid".
+        workers (int, optional): The number of worker processes. Defaults to None, one per CPU.
+        chunk_size (int, optional): The iterations per task. Defaults to None, the chunk size of the checkpoints if
+                                    they have one, otherwise about four tasks per worker over the whole run,
+                                    with at most 50 iterations each.
+        pool (multiprocessing.Pool, optional): A running pool to use and leave open. Defaults to None.
+        on_complete (function, optional): Called with each finished sweep dict, in the order targets finish.
+                                          Defaults to None.
+        progress (function, optional): Called after every chunk with the chunks and targets done, their totals
+                                       and the elapsed time. Defaults to print_progress, None for silence.
+        seeds (list, optional): The seed of every target, which makes the sweeps reproducible. Defaults to None.
+        checkpoint (campaign.ChunkCheckpoint, optional): Chunks found in it are not solved again, and every new chunk
+                                                         and finished target is recorded in it, along with the
+                                                         chunk size. Defaults to None.
+
+    Returns:
+        list: The sweep dicts in the order of observations, the same as run_error_sweep returns.
+
+    Raises:
+        ValueError: If chunk_size differs from the chunk size of the checkpoints.
+    """
+    observations, percent_errors, iterations = prepare_targets(observations, percent_errors)
+
+    start_time = datetime.datetime.now()
+    pool_context = multiprocessing.Pool(workers) if pool is None else contextlib.nullcontext(pool)
+
+    with pool_context as pool:
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        total_iterations = sum(len(target_iterations) for target_iterations in iterations) * len(modes)
+        chunk_size = checkpoint_chunk_size(checkpoint, chunk_size, lambda: min(50, max(1, -(-total_iterations // (4 * workers)))))
+
+        nominal_locations = [None] * len(observations)
+        for index, nominal_location in pool.imap_unordered(_solve_nominal_star,
+                                                           [(index, observation, engine) for index, observation in enumerate(observations)]):
+            nominal_locations[index] = nominal_location
+
+        tasks = build_chunk_tasks(observations, iterations, nominal_locations, modes, engine, chunk_size, seeds)
+        collector = SweepCollector(observations, percent_errors, nominal_locations, tasks, modes, start_time,
+                                   on_complete=on_complete, progress=progress, checkpoint=checkpoint, engine=engine)
+        tasks = collector.restore(tasks)
+        for result in pool.imap_unordered(_run_chunk_star, tasks):
+            collector.add(*result)
+
+    return collector.sweeps
@@ -4,6 +4,10 @@ import matplotlib.pyplot as plt
 import os
 import plotly.express as px
 import plotly.graph_objects as go
+import glob
+import json
+from streaming_stats import StreamingStats
+import results_store
 
 def write_stats(timestamp, runtime="unavailable"):
     """
@@ -202,6 +206,8 @@ def write_stats(timestamp, runtime="unavailable"):
         """
 
     def filter_percentiles(values, lower_percentile=5, upper_percentile=95):
+        if not values:
+            return []
         lower_bound = np.percentile(values, lower_percentile)
         upper_bound = np.percentile(values, upper_percentile)
         return [v for v in values if lower_bound <= v <= upper_bound]
@@ -230,8 +236,88 @@ def write_stats(timestamp, runtime="unavailable"):
         fig.update_layout(title=f'{title} Box Plot', yaxis_title='Value')
         fig.write_html(filepath)
 
+    def write_pooled_statistics(filename, f):
+        """
+        Merges the per city distance summaries written by find_position_Error.py and writes the
+        statistics of every sample of every city together.
+
+        Parameters
+        ----------
+        filename : str
+            The test directory holding the <city_name>/<city_name>_stats.json files.
+        f : file
+            A file to write the statistics to.
+        """
+        pooled = StreamingStats()
+        for stats_file in sorted(glob.glob(f"{filename}/*/*_stats.json")):
+            with open(stats_file) as stats_json:
+                pooled.merge(StreamingStats.from_dict(json.load(stats_json)))
+
+        if not pooled.count:
+            print("No per city distance summaries found.")
+            return
+
+        percentiles = [95, 90, 85, 80]
+        f.write(f"\n\nPooled distances of all {pooled.count} samples")
+        f.write(f"\nMean pooled value: {pooled.mean}")
+        f.write(f"\nStandard deviation of pooled values: {pooled.std}")
+        f.write(f"\nMedian pooled value: {pooled.median}")
+        f.write(f"\nMinimum pooled value: {pooled.minimum}")
+        f.write(f"\nMaximum pooled value: {pooled.maximum}")
+        for percentile in percentiles:
+            f.write(f"\n{percentile}th percentile pooled value: {pooled.percentile(percentile)}")
+
+        edges, counts = pooled.histogram()
+        fig = go.Figure()
+        fig.add_trace(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=pooled.bin_width,
+                             marker_color='#1f77b4', opacity=0.75, name='Histogram'))
+        fig.update_layout(
+            title=f'Histogram of All Distances with {pooled.bin_width}-Step Bins',
+            xaxis_title='Distance from intended target in miles',
+            yaxis_title='Frequency',
+            showlegend=True,
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            autosize=False,
+            width=900,
+            height=600
+        )
+        for i, percentile in enumerate(percentiles):
+            fig.add_annotation(
+                x=pooled.percentile(percentile),
+                y=i * 200,
+                text=f'{percentile}th percentile: {pooled.percentile(percentile):.2f}',
+                showarrow=True,
+                arrowhead=2,
+                ax=0,
+                ay=-40
+            )
+        fig.write_html(filename + "/pooled_distro.html")
+
+    def load_values(filename):
+        """
+        Loads the mean, median, minimum, and maximum of every target from the results store, or
+        scrapes them from test_results.txt for tests written before the store existed.
+
+        Parameters
+        ----------
+        filename : str
+            The test directory.
+
+        Returns
+        -------
+        tuple of list of float
+            The mean, median, minimum and maximum values, as extract_values returns them.
+        """
+        targets = results_store.load_targets(filename)
+        if not targets:
+            return extract_values(filename + "/test_results.txt")
+        # Jacobian predictions are stored as predicted_mean and predicted_median and are not pooled
+        return tuple([value for value in targets.get(name, []) if np.isfinite(value)]
+                     for name in ("mean", "median", "minimum", "maximum"))
+
     filename = f"Tests/{timestamp}"
-    mean_values, median_values, minimum_values, maximum_values = extract_values(filename + "/test_results.txt")
+    mean_values, median_values, minimum_values, maximum_values = load_values(filename)
 
 
     with open(filename + "/test_results.txt", "a") as f:
@@ -243,10 +329,11 @@ def write_stats(timestamp, runtime="unavailable"):
             plot_histograms(value, key, filename + "/" + key + "_distro.html")
             create_box_plot(value, key, f"{filename}/{key.lower()}_box_plot.html")
             write_statistics(value, key, f)
-            percentile_below_threshold(value, threshold=300)
-            print(f"{key} percentile below 300: {percentile_below_threshold(value, threshold=300)}%")
+            if value:
+                print(f"{key} percentile below 300: {percentile_below_threshold(value, threshold=300)}%")
         create_combined_box_plot(mean_values, median_values, minimum_values, maximum_values, f"{filename}/combined_box_plot.html")
         plot_combined_histograms(mean_values, median_values, minimum_values, maximum_values, f"{filename}/combined_histograms.html")
+        write_pooled_statistics(filename, f)
 
         
         f.write(f"\n\nTotal runtime: {runtime}\n")